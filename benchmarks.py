@@ -0,0 +1,630 @@
+import argparse
+import base64
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import built_systems
+import social_systems
+import utils
+
+# Benchmarks for the pandas transforms and chart builders on synthetic data.
+# Every case runs at SCALES times its base row count, roughly the size of today's data.
+# python benchmarks.py [--cases ...] [--scales 1 10 100] [--repeat 3]
+# python benchmarks.py --imports times module imports and CLI startup instead
+# python benchmarks.py --check compares the fast chart builders' figures with plotly express'
+# and the charts written in each output mode (typed arrays, shared data) with plain json
+# python benchmarks.py --sizes [html] reports what the dashboard template saves in each chart
+SCALES = [1, 10, 100]
+RESULTS_DIR = Path("data/benchmarks")
+# modules whose import is timed, each in a fresh interpreter
+IMPORT_MODULES = [
+    "utils",
+    "climate_conditions",
+    "natural_systems",
+    "built_systems",
+    "social_systems",
+    "indicators",
+]
+# libraries that are only imported once a function needs them, reported if an import loads them
+HEAVY_MODULES = ["arcgis", "plotly.express", "plotly.graph_objects", "meteostat", "requests"]
+# commands whose whole run is timed
+STARTUP_COMMANDS = {"indicators --list": ["-m", "indicators", "--list"]}
+
+RACES = [
+    "Total population:  Hispanic or Latino",
+    "Total population:  Not Hispanic or Latino; White alone",
+    "Total population:  Not Hispanic or Latino; Black or African American alone",
+    "Total population:  Not Hispanic or Latino; American Indian and Alaska Native alone",
+    "Total population:  Not Hispanic or Latino; Asian alone",
+    "Total population:  Not Hispanic or Latino; Native Hawaiian and Other Pacific Islander alone",
+    "Total population:  Not Hispanic or Latino; Some other race alone",
+    "Total population:  Not Hispanic or Latino; Two or more races",
+]
+MODES = ["Drive", "Walk", "Bike", "Transit", "Carpool", "Work from Home", "Shuttle", "Other"]
+SEASONS = ["Winter", "Spring", "Summer", "Fall"]
+BIKE_YEARS = ["2006", "2010", "2012", "2015", "2018", "2021", "before 2010", " 2014", "UNKNOWN"]
+
+_rng = np.random.default_rng(0)
+
+
+# Census rows for get_data_race_ethnicity, 13 years x 8 races per geography
+def race_ethnicity_data(rows):
+    geographies = ["Basin"] + [f"Geography {i}" for i in range(max(rows // 104, 1) - 1)]
+    index = pd.MultiIndex.from_product(
+        [geographies, range(2010, 2023), RACES], names=["Geography", "year_sample", "variable"]
+    )
+    df = index.to_frame(index=False).rename(columns={"variable": "variable_name"})
+    df["value"] = _rng.integers(0, 20000, len(df))
+    return df
+
+
+# Survey counts for get_data_mode_share, five samples per year, season, mode and source
+def mode_share_data(rows):
+    years = range(2000, 2000 + max(rows // 320, 1))
+    index = pd.MultiIndex.from_product(
+        [years, SEASONS, MODES, ["Survey", "Counter"], range(5)],
+        names=["Year", "Season", "Mode", "Source", "Sample"],
+    )
+    df = index.to_frame(index=False).drop(columns="Sample")
+    df["Number"] = _rng.integers(0, 500, len(df))
+    return df
+
+
+# Bike lane segments for get_data_low_stress_bicycle
+def low_stress_bicycle_data(rows):
+    return pd.DataFrame(
+        {
+            "CLASS": _rng.choice(["1", "2", "3"], rows),
+            "YR_OF_CONS": _rng.choice(BIKE_YEARS, rows),
+            "Shape.STLength()": _rng.uniform(10, 5000, rows),
+        }
+    )
+
+
+# Daily readings of one year per sensor for purpleair_api.make_unified_time_series
+def purple_air_data(rows):
+    days = pd.date_range("2023-01-01", periods=365).strftime("%Y-%m-%d")
+    sensors = max(rows // len(days), 1)
+    df = pd.DataFrame(
+        {
+            "time_stamp": np.tile(days, sensors),
+            "sensor_index": np.repeat(np.arange(sensors), len(days)),
+            "pm2.5_alt_a": _rng.gamma(2, 3, sensors * len(days)),
+            "pm2.5_alt_b": _rng.gamma(2, 3, sensors * len(days)),
+        }
+    )
+    df.loc[_rng.random(len(df)) < 0.02, "pm2.5_alt_b"] = np.nan
+    return df
+
+
+# Long table of a value by year and category, the shape every chart builder takes
+def chart_data(rows):
+    categories = [f"Category {i}" for i in range(5)]
+    years = range(1900, 1900 + max(rows // (len(categories) * 2), 1))
+    index = pd.MultiIndex.from_product(
+        [years, categories, ["Lake Tahoe Region", "California"]],
+        names=["Year", "Category", "Geography"],
+    )
+    df = index.to_frame(index=False)
+    df["Value"] = _rng.uniform(0, 100, len(df))
+    df["Value2"] = _rng.uniform(0, 100, len(df))
+    return df
+
+
+@contextmanager
+def _fetch_returns(module, df):
+    fetch = module.get_fs_data
+    module.get_fs_data = lambda *args, **kwargs: df.copy()
+    try:
+        yield
+    finally:
+        module.get_fs_data = fetch
+
+
+def run_race_ethnicity(df, workdir):
+    with _fetch_returns(social_systems, df):
+        return social_systems.get_data_race_ethnicity()
+
+
+def run_mode_share(df, workdir):
+    with _fetch_returns(built_systems, df):
+        return built_systems.get_data_mode_share()
+
+
+def run_low_stress_bicycle(df, workdir):
+    with _fetch_returns(built_systems, df):
+        return built_systems.get_data_low_stress_bicycle()
+
+
+def setup_purple_air(df, workdir):
+    sensor_dir = workdir / "data/PurpleAir/all_sensors"
+    sensor_dir.mkdir(parents=True, exist_ok=True)
+    for sensor, rows in df.groupby("sensor_index"):
+        rows.to_csv(sensor_dir / f"{sensor}.csv", index=False)
+
+
+def run_purple_air(df, workdir):
+    # imported here, it needs tqdm and reads its sensor table from the repo's data directory
+    # on import, which the other cases don't
+    import purpleair_api
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        return purpleair_api.make_unified_time_series()
+    finally:
+        os.chdir(cwd)
+
+
+CHART = dict(x="Year", y="Value", hovertemplate="%{y:,.0f}", hovermode="x unified")
+
+
+def run_trendline(df, workdir):
+    utils.trendline(
+        df[df["Geography"] == "Lake Tahoe Region"],
+        path_html=str(workdir / "trendline.html"),
+        div_id="trendline",
+        color="Category",
+        color_sequence=None,
+        sort="Year",
+        orders=None,
+        x_title="Year",
+        y_title="Value",
+        format=",.0f",
+        markers=True,
+        hover_data=None,
+        tickvals=None,
+        ticktext=None,
+        tickangle=None,
+        custom_data=None,
+        **CHART,
+    )
+
+
+def run_stackedbar(df, workdir):
+    utils.stackedbar(
+        df[df["Geography"] == "Lake Tahoe Region"],
+        path_html=str(workdir / "stackedbar.html"),
+        div_id="stackedbar",
+        color="Category",
+        color_sequence=None,
+        orders=None,
+        y_title="Value",
+        x_title="Year",
+        custom_data=None,
+        format=",.0f",
+        **CHART,
+    )
+
+
+def run_groupedbar_percent(df, workdir):
+    utils.groupedbar_percent(
+        df,
+        path_html=str(workdir / "groupedbar_percent.html"),
+        div_id="groupedbar_percent",
+        facet="Geography",
+        color="Category",
+        color_sequence=None,
+        orders=None,
+        y_title="Value",
+        x_title="Year",
+        format=".0%",
+        **CHART,
+    )
+
+
+def run_scatterplot(df, workdir):
+    df = df[(df["Geography"] == "Lake Tahoe Region") & (df["Category"] == "Category 0")]
+    utils.scatterplot(
+        df,
+        path_html=str(workdir / "scatterplot.html"),
+        div_id="scatterplot",
+        y2="Value2",
+        color=None,
+        color_sequence=None,
+        y_title="Value",
+        x_title="Year",
+        legend_number=1,
+        legend_otherline="Value2",
+        **CHART,
+    )
+
+
+def run_stacked_area(df, workdir):
+    utils.stacked_area(
+        df[df["Geography"] == "Lake Tahoe Region"],
+        path_html=str(workdir / "stacked_area.html"),
+        div_id="stacked_area",
+        color="Category",
+        line_group="Category",
+        color_sequence=None,
+        x_title="Year",
+        y_title="Value",
+        format=",.0f",
+        **CHART,
+    )
+
+
+# Figures the chart builders make, kept instead of written to html
+@contextmanager
+def _captured_figures():
+    figures = []
+    write_html = utils.go.Figure.write_html
+    utils.go.Figure.write_html = lambda fig, *args, **kwargs: figures.append(fig)
+    try:
+        yield figures
+    finally:
+        utils.go.Figure.write_html = write_html
+
+
+# Figure json without the template, plotly express sets some of the dashboard template's
+# layout (utils.TEMPLATE_LAYOUT) on the figure itself
+def _figure_json(fig):
+    figure = json.loads(fig.to_json())
+    figure["layout"].pop("template", None)
+    for key, value in utils.TEMPLATE_LAYOUT.items():
+        if figure["layout"].get(key) == value:
+            del figure["layout"][key]
+    return figure
+
+
+# First path where two json values differ, or None
+def _difference(a, b, path=""):
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in sorted(set(a) | set(b)):
+            if a.get(key, {}) != b.get(key, {}):
+                return _difference(a.get(key), b.get(key), f"{path}/{key}")
+        return None
+    if isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        for i, (x, y) in enumerate(zip(a, b)):
+            if x != y:
+                return _difference(x, y, f"{path}[{i}]")
+        return None
+    if isinstance(a, float) and isinstance(b, float) and abs(a - b) < 1e-9:
+        return None
+    return None if a == b else f"{path}: {a!r:.80} != {b!r:.80}"
+
+
+# Build each chart of FAST_CASES with plotly express and with the fast builders
+def check_fast_builders(scale=1):
+    failed = 0
+    for name in FAST_CASES:
+        base_rows, make_input, setup, run = CASES[name]
+        df = make_input(base_rows * scale)
+        figures = []
+        for fast in [False, True]:
+            utils.FAST_BUILDERS = fast
+            with tempfile.TemporaryDirectory() as workdir, _captured_figures() as captured:
+                run(df, Path(workdir))
+            figures.append(_figure_json(captured[0]))
+        utils.FAST_BUILDERS = True
+        difference = _difference(*figures) if figures[0] != figures[1] else None
+        failed += difference is not None
+        print(f"{name:<28} {'differs at ' + difference if difference else 'same'}")
+    return failed
+
+
+# Trace arrays read back as the page gets them: typed arrays decoded, float32 values as the
+# shortest decimal that reads back as the same float32, missing numbers as None
+def _decoded(value):
+    if isinstance(value, dict) and "bdata" in value:
+        dtype = np.dtype(value["dtype"]).newbyteorder("<")
+        values = np.frombuffer(base64.b64decode(value["bdata"]), dtype=dtype)
+        if "shape" in value:
+            values = values.reshape([int(n) for n in value["shape"].split(",")])
+        if value["dtype"] == "f4":
+            values = np.array([float(str(v)) for v in values.flat]).reshape(values.shape)
+        return _decoded(values.tolist())
+    if isinstance(value, dict):
+        return {key: _decoded(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_decoded(v) for v in value]
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+# Dates written as strings as the milliseconds since 1970 the typed arrays hold
+def _date_numbers(values):
+    dates = pd.to_datetime(pd.Series(values)).astype("datetime64[ms]")
+    return [None if pd.isna(d) else float(d.value // 10**6) for d in dates]
+
+
+# Charts of the page at path as the browser gets them: the arrays of a shared data file put
+# back and typed arrays decoded
+def _page_figures(path):
+    text = path.read_text(encoding="utf-8")
+    figures = _embedded_figures(text)
+    bind = re.search(r'var source = "([^"]+)", refs = (\[.*?\]);', text)
+    if bind:
+        shared = json.loads((path.parent / bind.group(1)).read_text())
+        for index, attribute, key in json.loads(bind.group(2)):
+            figures[0][0][index][attribute] = shared[key]
+    return [dict(data=data, layout=layout) for data, layout in _decoded(figures)]
+
+
+# Date strings on axes, as the milliseconds since 1970 typed arrays write dates as
+def _dates_as_numbers(figures, axes):
+    for figure in figures:
+        for trace in figure["data"]:
+            for attribute in ["x", "y"]:
+                name = trace.get(f"{attribute}axis", attribute)
+                values = trace.get(attribute)
+                if f"{attribute}axis{name[1:]}" in axes and isinstance(values, list):
+                    if any(isinstance(v, str) for v in values):
+                        trace[attribute] = _date_numbers(values)
+
+
+# Write each chart of CHART_CASES as json and in each of OUTPUT_MODES, compare what the pages
+# draw and the bytes they load (the page and its data files, not plotly.js)
+def check_output_modes(scale=1):
+    failed = 0
+    for name in CHART_CASES:
+        base_rows, make_input, setup, run = CASES[name]
+        df = make_input(base_rows * scale)
+        pages = {}
+        for mode, settings in {"json": {}, **OUTPUT_MODES}.items():
+            for setting in settings:
+                setattr(utils, setting, True)
+            try:
+                with tempfile.TemporaryDirectory() as workdir:
+                    run(df, Path(workdir))
+                    path = next(Path(workdir).glob("*.html"))
+                    files = [path] + list(Path(workdir).rglob("*.json"))
+                    pages[mode] = (sum(f.stat().st_size for f in files), _page_figures(path))
+            finally:
+                for setting in settings:
+                    setattr(utils, setting, False)
+        # axes typed arrays made date axes, the json page leaves plotly to guess
+        date_axes = {
+            key
+            for size, figures in pages.values()
+            for figure in figures
+            for key, axis in figure["layout"].items()
+            if isinstance(axis, dict) and axis.get("type") == "date"
+        }
+        written = pages.pop("json")
+        for size, figures in [written, *pages.values()]:
+            _dates_as_numbers(figures, date_axes)
+            for figure, json_figure in zip(figures, written[1]):
+                for key in date_axes:
+                    if "type" not in json_figure["layout"].get(key, {}):
+                        figure["layout"].get(key, {}).pop("type", None)
+        line = f"{name:<20} {written[0] / 1e3:6.1f} KB json"
+        for mode, (size, figures) in pages.items():
+            difference = _difference(written[1], figures) if figures != written[1] else None
+            failed += difference is not None
+            line += f"  {size / 1e3:6.1f} KB {mode} {'differs at ' + difference if difference else 'same'}"
+        print(line)
+    return failed
+
+
+# case -> (base row count, make input, setup(df, workdir) or None, run(df, workdir))
+CASES = {
+    "get_data_race_ethnicity": (416, race_ethnicity_data, None, run_race_ethnicity),
+    "get_data_mode_share": (1600, mode_share_data, None, run_mode_share),
+    "get_data_low_stress_bicycle": (1500, low_stress_bicycle_data, None, run_low_stress_bicycle),
+    "make_unified_time_series": (20000, purple_air_data, setup_purple_air, run_purple_air),
+    "trendline": (200, chart_data, None, run_trendline),
+    "stackedbar": (200, chart_data, None, run_stackedbar),
+    "groupedbar_percent": (200, chart_data, None, run_groupedbar_percent),
+    "scatterplot": (200, chart_data, None, run_scatterplot),
+    "stacked_area": (200, chart_data, None, run_stacked_area),
+}
+# builders with a graph_objects path, see utils._fast_figure
+FAST_CASES = ["trendline", "stackedbar", "groupedbar_percent"]
+# cases that write a chart
+CHART_CASES = ["trendline", "stackedbar", "groupedbar_percent", "scatterplot", "stacked_area"]
+# output modes compared with plain json by --check: {mode: utils settings it turns on}
+OUTPUT_MODES = {"typed arrays": ["BINARY_ARRAYS"], "shared data": ["SHARED_DATA"]}
+
+
+# Best wall time of repeat runs after an untimed warm up run (lazy imports, caches),
+# then one more run under tracemalloc for the memory peak
+def run_case(name, scale, repeat=3):
+    base_rows, make_input, setup, run = CASES[name]
+    df = make_input(base_rows * scale)
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        if setup:
+            setup(df, workdir)
+        run(df, workdir)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(df, workdir)
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            run(df, workdir)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return dict(case=name, scale=scale, rows=len(df), seconds=min(times), peak_memory_bytes=peak)
+
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps(dict(seconds=seconds, loaded=[m for m in {heavy!r} if m in sys.modules])))
+"""
+
+
+# Best time of repeat imports of module, each in a new interpreter so nothing is already loaded
+def import_time(module, repeat=3):
+    script = _IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return dict(
+        case=f"import {module}",
+        scale=1,
+        seconds=min(run["seconds"] for run in runs),
+        loaded=runs[0]["loaded"],
+    )
+
+
+def startup_time(name, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *STARTUP_COMMANDS[name]], capture_output=True, check=True)
+        times.append(time.perf_counter() - start)
+    return dict(case=name, scale=1, seconds=min(times), loaded=None)
+
+
+def run_imports(previous, repeat=3):
+    results = []
+    print(f"{'case':<28} {'seconds':>9}  vs last  heavy modules loaded")
+    runs = [partial(import_time, module) for module in IMPORT_MODULES]
+    runs += [partial(startup_time, name) for name in STARTUP_COMMANDS]
+    for run in runs:
+        result = run(repeat)
+        results.append(result)
+        last = previous.get((result["case"], 1))
+        change = f"{result['seconds'] / last['seconds']:.2f}x" if last else ""
+        print(
+            f"{result['case']:<28} {result['seconds']:>9.3f}  {change:>7}"
+            f"  {', '.join(result['loaded'] or [])}"
+        )
+    return results
+
+
+def run_cases(previous, cases, scales, repeat=3):
+    results = []
+    print(f"{'case':<28} {'scale':>5} {'rows':>9} {'seconds':>9} {'MB peak':>8}  vs last")
+    for name in cases:
+        # plotly express runs of the fast builders are kept apart from the fast runs
+        label = f"{name} (px)" if name in FAST_CASES and not utils.FAST_BUILDERS else name
+        for scale in scales:
+            result = dict(run_case(name, scale, repeat), case=label)
+            results.append(result)
+            last = previous.get((label, scale))
+            change = f"{result['seconds'] / last['seconds']:.2f}x" if last else ""
+            print(
+                f"{label:<28} {scale:>5} {result['rows']:>9} {result['seconds']:>9.3f}"
+                f" {result['peak_memory_bytes'] / 1e6:>8.1f}  {change}"
+            )
+    return results
+
+
+# (data, layout) of the charts in an html file written by write_html
+def _embedded_figures(text):
+    decoder = json.JSONDecoder()
+    figures = []
+    for match in re.finditer(r"Plotly\.newPlot\(\s*", text):
+        position = match.end()
+        # the div id, the data and the layout, calls in the page's own scripts don't parse
+        try:
+            values = []
+            for i in range(3):
+                value, position = decoder.raw_decode(text, position)
+                position = re.compile(r"\s*,?\s*").match(text, position).end()
+                values.append(value)
+        except json.JSONDecodeError:
+            continue
+        figures.append(tuple(values[1:]))
+    return figures
+
+
+# Size of every chart in directory with the template it was written with and with the
+# dashboard template, the data and the rest of the layout are left as they are
+def template_sizes(directory="html"):
+    figure = utils.go.Figure(layout=dict(template=utils.dashboard_template()))
+    lean = len(json.dumps(json.loads(figure.to_json())["layout"]["template"]))
+    rows = []
+    for path in sorted(Path(directory).glob("*.html")):
+        text = path.read_text(encoding="utf-8")
+        layouts = [layout for data, layout in _embedded_figures(text)]
+        written = sum(len(json.dumps(layout.get("template", {}))) for layout in layouts)
+        if not written:
+            continue
+        before = len(text.encode("utf-8"))
+        after = before - written + lean * len(layouts)
+        rows.append((path.name, before, after))
+    print(f"{'before KB':>10} {'after KB':>10} {'saved':>6}  chart")
+    for name, before, after in rows:
+        print(f"{before / 1e3:10.1f} {after / 1e3:10.1f} {1 - after / before:6.0%}  {name}")
+    before, after = sum(r[1] for r in rows), sum(r[2] for r in rows)
+    if rows:
+        print(f"{before / 1e3:10.1f} {after / 1e3:10.1f} {1 - after / before:6.0%}  total")
+    return rows
+
+
+# Latest earlier result of every case, import timings and transform runs are saved separately
+def _previous_results():
+    previous = {}
+    for path in sorted(RESULTS_DIR.glob("*.json")):
+        for result in json.loads(path.read_text())["results"]:
+            previous[(result["case"], result["scale"])] = result
+    return previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark transforms and chart builders.")
+    parser.add_argument("--cases", nargs="*", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--scales", nargs="*", type=int, default=SCALES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--imports", action="store_true", help="time module imports and CLI startup instead"
+    )
+    parser.add_argument("--px", action="store_true", help="build every chart with plotly express")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="check the fast builders draw the same figures as plotly express and the output"
+        " modes the same as json",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="?",
+        const="html",
+        metavar="DIR",
+        help="report the charts' sizes with the dashboard template instead",
+    )
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        template_sizes(args.sizes)
+        return 0
+    if args.check:
+        failed = check_fast_builders()
+        failed += check_output_modes()
+        return 1 if failed else 0
+    utils.FAST_BUILDERS = not args.px
+    previous = _previous_results()
+    if args.imports:
+        results = run_imports(previous, args.repeat)
+    else:
+        results = run_cases(previous, args.cases, args.scales, args.repeat)
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    created = datetime.now()
+    path = RESULTS_DIR / f"{created:%Y%m%d_%H%M%S}.json"
+    path.write_text(
+        json.dumps(dict(created=created.isoformat(timespec="seconds"), results=results), indent=2)
+    )
+    print(f"Saved {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,25 @@
+from io import StringIO
+
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 
+import http_client
 from utils import (
-    convert_to_utc,
     create_stacked_bar_plot_with_dropdown,
+    dashboard_template,
     get_fs_data,
-    get_fs_data_spatial,
     get_fs_data_spatial_query,
+    lazy_import,
     read_file,
+    round_traces,
     stacked_area,
     stackedbar,
     trendline,
+    write_html,
 )
 
+go = lazy_import("plotly.graph_objects")
+
 # # get data for affordable units
 # def get_data_affordable_units():
 #     # parcel development history layer
@@ -56,20 +62,23 @@ from utils import (
 
 
 # get data for affordable units by year
-def get_data_affordable_units_by_year():
+# constructed deed restricted units, shared by the two deed restriction getters
+def get_deed_restricted_units():
     # deed restricted housing units table
     deedURL = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/148"
-    # data = get_fs_data_query(deedURL, "Date_Type = 'Constructed")
-    df = get_fs_data(deedURL)
-    # filter df to Date_Type = Constructed
-    df = df.loc[df.Date_Type == "Constructed"]
-    # cast Finaled_Date as datetime using utc time
-    df["Finaled_Date"] = df.Finaled_Date.apply(convert_to_utc)
-    df["Finaled_Date"] = pd.to_datetime(df["Finaled_Date"])
-    # convert Finaled_Date
-    df["Finaled_Date"] = df["Finaled_Date"].dt.strftime("%m/%d/%Y")
-    # get Year field from Finaled_Date date as Y
-    df["Year"] = df.Finaled_Date.str[-4:]
+    return get_fs_data(
+        deedURL,
+        where="Date_Type = 'Constructed'",
+        out_fields=["Deed_Restriction_Type", "LOCATION_TO_TOWNCENTER", "Finaled_Date", "Units"],
+        sync=True,
+    )
+
+
+def get_data_affordable_units_by_year(df=None):
+    if df is None:
+        df = get_deed_restricted_units()
+    # get Year field from Finaled_Date, which comes back as a utc datetime
+    df["Year"] = df["Finaled_Date"].dt.strftime("%Y")
     # group by Deed_Restriction_Type and Year
     df = df.groupby(["Deed_Restriction_Type", "Year"])["Units"].sum().reset_index()
     # sort year
@@ -200,13 +209,9 @@ def plot_data_deed_restricted(df):
 
 
 # get data for affordable units
-def get_data_affordable_units():
-    # deed restricted housing units table
-    deedURL = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/148"
-    # data = get_fs_data_query(deedURL, "Date_Type = 'Constructed")
-    df = get_fs_data(deedURL)
-    # filter df to Date_Type = Constructed
-    df = df.loc[df.Date_Type == "Constructed"]
+def get_data_affordable_units(df=None):
+    if df is None:
+        df = get_deed_restricted_units()
     # group by Deed_Restriction_Type and LOCATION_TO_TOWNCENTER
     df = (
         df.groupby(["Deed_Restriction_Type", "LOCATION_TO_TOWNCENTER"])["Units"].sum().reset_index()
@@ -279,17 +284,13 @@ def get_data_home_heating():
         "Solar energy": "Solar",
     }
     data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135",
+        where="Category = 'Home Heating Method' AND variable_name <> 'Total Heating Methods'",
+        out_fields=["variable_name", "value", "Geography", "year_sample"],
+        paginate=True,
     )
     data["Geography"] = data["Geography"].replace({"Basin": "Lake Tahoe Region"})
-    mask = (data["Category"] == "Home Heating Method") & (
-        data["variable_name"] != "Total Heating Methods"
-    )
-    val = (
-        data[mask]
-        .loc[:, ["variable_name", "value", "Geography", "year_sample"]]
-        .rename(columns={"year_sample": "Year", "variable_name": "Energy Source"})
-    )
+    val = data.rename(columns={"year_sample": "Year", "variable_name": "Energy Source"})
     # drop rows in val that are not in heating_groupings
     df = val[val["Energy Source"].isin(heating_groupings.keys())]
     # replace engery source with groupings in heating_groupings
@@ -373,7 +374,7 @@ def plot_energy_mix(df):
 def get_data_transit():
     url = "https://www.laketahoeinfo.org/WebServices/GetTransitMonitoringData/CSV/e17aeb86-85e3-4260-83fd-a2b32501c476"
 
-    dfTransit = pd.read_csv(url)
+    dfTransit = pd.read_csv(StringIO(http_client.get(url).text))
     dfTransit["Month"] = pd.to_datetime(dfTransit["Month"])
     dfTransit["Month"] = dfTransit["Month"].dt.strftime("%Y-%m")
     # filter out rows where RouteType is not Paratransit, Commuter, or Seasonal Fixed
@@ -448,7 +449,9 @@ def plot_transit(df):
 # get data for vehicle miles traveled
 def get_data_vehicle_miles_traveled():
     vmt_data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/133"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/133",
+        where="year > 2015",
+        out_fields=["year", "CA", "NV", "Total"],
     )
     vmt_data[["CA", "NV", "Total"]] = vmt_data[["CA", "NV", "Total"]].apply(
         lambda x: x.str.replace(",", "").dropna().astype(int)
@@ -492,9 +495,10 @@ def plot_vehicle_miles_traveled(df):
 # get data for mode share
 def get_data_mode_share():
     modeshare_data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/136"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/136",
+        where="Source <> 'LOCUS'",
+        out_fields=["Year", "Season", "Mode", "Source", "Number"],
     )
-    modeshare_data = modeshare_data.query('Source!="LOCUS"')
     modeshare_data_grouped = (
         modeshare_data.groupby(["Year", "Season", "Mode", "Source"])
         .agg({"Number": "mean"})
@@ -683,7 +687,10 @@ def plot_mode_share(df):
     )
 
     fig.update_layout(
-        title_text="Modeshare by Source", template="plotly_white", dragmode=False, legend_title=None
+        title_text="Modeshare by Source",
+        template=dashboard_template(),
+        dragmode=False,
+        legend_title=None,
     )
     source_sort = ["LOCUS", "Replica", "Survey"]
 
@@ -844,7 +851,9 @@ def plot_mode_share(df):
     fig.update_layout(title_text="Transportation Modeshare", margin=dict(t=40))
     fig.update_xaxes(categoryorder="array", categoryarray=x_order)
     fig.update_yaxes(title_text="% Modeshare", ticksuffix="%")
-    fig.write_html(
+    round_traces(fig, path_html)
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
@@ -854,11 +863,14 @@ def plot_mode_share(df):
 
 # get data for low stress bicycle
 def get_data_low_stress_bicycle():
-    sdf_bikelane = get_fs_data_spatial(
-        "https://maps.trpa.org/server/rest/services/Transportation/MapServer/3"
+    # attributes only, the server computed shape length stands in for the line geometry
+    sdf_bikelane = get_fs_data(
+        "https://maps.trpa.org/server/rest/services/Transportation/MapServer/3",
+        where="CLASS IN ('1', '2', '3')",
+        out_fields=["CLASS", "YR_OF_CONS", "Shape.STLength()"],
     )
     # recalc miles field from shape length
-    sdf_bikelane.MILES = sdf_bikelane["Shape.STLength()"] / 1609.34
+    sdf_bikelane["MILES"] = sdf_bikelane["Shape.STLength()"] / 1609.34
     # filter for CLASS = 1 2 or 3
     filtered_sdf_bikelane = sdf_bikelane[sdf_bikelane["CLASS"].isin(["1", "2", "3"])]
     # fix bad values
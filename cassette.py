@@ -0,0 +1,100 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+
+# live talks to the services, record talks to them and saves every response,
+# replay answers from the saved responses only so a build runs without a network
+MODE = os.environ.get("DASHBOARD_HTTP_MODE", "live")
+CASSETTE_DIR = Path(os.environ.get("DASHBOARD_CASSETTE_DIR", "data/cassettes"))
+# seconds added to every replayed response to stand in for the network
+REPLAY_LATENCY = float(os.environ.get("DASHBOARD_REPLAY_LATENCY", "0"))
+# dates in urls and queries move with the clock (e.g. the last 400 days of lake temperature),
+# they are left out of the key so a recording replays on any day
+_DATE = re.compile(r"(?<!\d)(19|20)\d{2}-?\d{2}-?\d{2}(?!\d)")
+# the recorded body is already decompressed
+_DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+# Readable file name for a recording, e.g. maps_trpa_org_server_..._query__<hash of key>
+def _file_name(label, key):
+    prefix = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")[-80:]
+    digest = hashlib.sha1(_DATE.sub("<date>", json.dumps(key, default=str)).encode("utf-8"))
+    return f"{prefix}__{digest.hexdigest()[:16]}"
+
+
+def _request_path(method, url, params=None, data=None):
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + list((params or {}).items()) + list((data or {}).items())
+    query = sorted((str(name), str(value)) for name, value in query)
+    key = [method.upper(), parts.netloc, parts.path, query]
+    return CASSETTE_DIR / f"{_file_name(parts.netloc + parts.path, key)}.json.gz"
+
+
+def _missing(what):
+    return RuntimeError(
+        f"No recording for {what} in {CASSETTE_DIR}, run once with DASHBOARD_HTTP_MODE=record"
+    )
+
+
+def _wait():
+    if REPLAY_LATENCY:
+        time.sleep(REPLAY_LATENCY)
+
+
+# Save a live response so it can be replayed
+def record_response(method, url, response, params=None, data=None):
+    entry = dict(
+        url=response.url,
+        status=response.status_code,
+        reason=response.reason,
+        encoding=response.encoding,
+        headers={k: v for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS},
+        content=base64.b64encode(response.content).decode("ascii"),
+    )
+    path = _request_path(method, url, params, data)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(gzip.compress(json.dumps(entry).encode("utf-8")))
+
+
+# Rebuild the recorded response for a request
+def replay_response(method, url, params=None, data=None):
+    path = _request_path(method, url, params, data)
+    if not path.exists():
+        raise _missing(f"{method.upper()} {url}")
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    entry = json.loads(gzip.decompress(path.read_bytes()))
+    _wait()
+    response = requests.Response()
+    response.url = entry["url"]
+    response.status_code = entry["status"]
+    response.reason = entry["reason"]
+    response.encoding = entry["encoding"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response._content = base64.b64decode(entry["content"])
+    return response
+
+
+# Record or replay the dataframe fetch() returns, for libraries that make their own requests
+# (meteostat, arcgis geometry queries). name and key identify the call.
+def recorded(name, key, fetch):
+    path = CASSETTE_DIR / f"{_file_name(name, [name, key])}.pkl.gz"
+    if MODE == "replay":
+        if not path.exists():
+            raise _missing(f"{name} {key}")
+        _wait()
+        return pd.read_pickle(path)
+    df = fetch()
+    if MODE == "record":
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_pickle(path)
+    return df
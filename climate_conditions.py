@@ -2,18 +2,32 @@ from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import requests
-from meteostat import Daily, Point
 
-from utils import convert_to_utc, get_fs_data, read_file, scatterplot, stackedbar, trendline
+import cassette
+import http_client
+from utils import (
+    dashboard_template,
+    downsample,
+    get_fs_data,
+    lazy_import,
+    read_file,
+    round_traces,
+    scatterplot,
+    stackedbar,
+    trendline,
+    write_html,
+)
+
+px = lazy_import("plotly.express")
+go = lazy_import("plotly.graph_objects")
+meteostat = lazy_import("meteostat")
 
 
 # get Greenhouse Gas data
 def get_data_greenhouse_gas():
     return get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/127"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/127",
+        out_fields=["Year", "MT_CO2", "Category"],
     )
 
 
@@ -102,17 +116,13 @@ def get_data_purple_air_TRPA():
     # Purple Air data
     purpleAirURL = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/143"
     # get data from the web service
-    dfPurpleAir = get_fs_data(purpleAirURL)
+    dfPurpleAir = get_fs_data(purpleAirURL, out_fields=["date", "mean_pm25"], sync=True)
     # groupby date and get the mean of pm25
     dfAir = dfPurpleAir.groupby("date")["mean_pm25"].mean().reset_index()
     # change column name to Date and PM 2.5 (ug/m3)
     dfAir = dfAir.rename(columns={"date": "Date", "mean_pm25": "PM 2.5 (ug/m3)"})
-    # Apply the function to the column
-    dfAir["Date"] = dfAir["Date"].apply(convert_to_utc)
-    # # convert Date to str
-    dfAir["Date"] = dfAir["Date"].dt.strftime("%m/%d/%Y")
-    # # convert Date to datetime
-    dfAir["Date"] = pd.to_datetime(dfAir["Date"], format="%m/%d/%Y")
+    # dates come back as UTC datetimes, drop the time of day
+    dfAir["Date"] = dfAir["Date"].dt.normalize()
     return dfAir
 
 
@@ -123,20 +133,20 @@ def get_fire_data():
     # Purple Air data hosted on TRPA's Enterprise Geodatabase
     purpleAirURL = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/143"
     # get data from the web service
-    dfPurpleAir = get_fs_data(purpleAirURL)
-    dfFire = get_fs_data(fireStartTable)
+    dfPurpleAir = get_fs_data(purpleAirURL, out_fields=["date", "mean_pm25"], sync=True)
+    # only the named fires from 2018 on
+    dfFire = get_fs_data(
+        fireStartTable,
+        where="FIRE_NAME IN ('CALDOR', 'TAMARACK', 'FERGUSON', 'MOSQUITO', 'LOYALTON') "
+        "AND ALARM_DATE >= DATE '2018-01-01'",
+        out_fields=["FIRE_NAME", "GIS_ACRES", "ALARM_DATE"],
+    )
     # remove nulls from ALARM_DATE
     dfFire = dfFire.dropna(subset=["ALARM_DATE"])
-    # remove negative numbers in ALARM_DATE
-    dfFire = dfFire[dfFire["ALARM_DATE"] > 0]
     # groupby date and get the mean of pm25
     dfAir = dfPurpleAir.groupby("date")["mean_pm25"].mean().reset_index()
-    # Apply the function to the column
-    dfFire["Date"] = dfFire["ALARM_DATE"].apply(convert_to_utc)
-    # convert Date to month day year
-    dfFire["Date"] = dfFire["Date"].dt.strftime("%m/%d/%Y")
-    # convert date to datetime
-    dfFire["Date"] = pd.to_datetime(dfFire["Date"], format="%m/%d/%Y")
+    # dates come back as UTC datetimes, drop the time of day
+    dfFire["Date"] = dfFire["ALARM_DATE"].dt.normalize()
     # filter date to 2018 or later
     dfFire = dfFire[dfFire["Date"] >= "01/01/2018"]
     # filter FIRE_NAME is ['CALDOR', 'TAMARACK', 'FERGUSON', 'MOSQUITO', 'LOYALTON']
@@ -149,12 +159,7 @@ def get_fire_data():
     dfFire = dfFire.rename(columns={"FIRE_NAME": "Fire", "GIS_ACRES": "Acres"})
     # change column name to Date and PM 2.5 (ug/m3)
     dfAir = dfAir.rename(columns={"date": "Date", "mean_pm25": "PM 2.5 (ug/m3)"})
-    # Apply the function to the column
-    dfAir["Date"] = dfAir["Date"].apply(convert_to_utc)
-    # # convert Date to str
-    dfAir["Date"] = dfAir["Date"].dt.strftime("%m/%d/%Y")
-    # # convert Date to datetime
-    dfAir["Date"] = pd.to_datetime(dfAir["Date"], format="%m/%d/%Y")
+    dfAir["Date"] = dfAir["Date"].dt.normalize()
 
     # merge with sdfPUrplAir on Date
     dfFire = dfFire.merge(dfAir, on="Date", how="left")
@@ -235,7 +240,7 @@ def plot_purple_air_fire(dfAir, dfFire):
         yaxis=dict(title=y_title),
         xaxis=dict(title=x_title, showgrid=False),
         hovermode=hovermode,
-        template="plotly_white",
+        template=dashboard_template(),
         dragmode=False,
         showlegend=False,
         # title_font_family="Bell Topo Sans",
@@ -259,7 +264,9 @@ def plot_purple_air_fire(dfAir, dfFire):
     # set color of line
     fig.update_traces(line=dict(color=color_sequence[0]))
 
-    fig.write_html(config=config, file=path_html, include_plotlyjs="directory", div_id=div_id)
+    round_traces(fig, path_html)
+    downsample(fig)
+    write_html(fig, config=config, file=path_html, include_plotlyjs="directory", div_id=div_id)
 
 
 def plot_purple_air(df):
@@ -291,7 +298,8 @@ def plot_purple_air(df):
 # get secchi depth data
 def get_data_secchi_depth():
     return get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/128"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/128",
+        out_fields=["year", "annual_average", "F5_year_average"],
     )
 
 
@@ -309,7 +317,7 @@ def plot_secchi_depth(df):
     fig.update_layout(
         yaxis=dict(title="Feet"),
         xaxis=dict(title="Year", showgrid=False),
-        template="plotly_white",
+        template=dashboard_template(),
         hovermode="x unified",
         dragmode=False,
         margin=dict(t=20),
@@ -339,7 +347,9 @@ def plot_secchi_depth(df):
     fig.data[2].showlegend = True
     fig.update_traces(hovertemplate="%{y:.1f}ft")
 
-    fig.write_html(
+    round_traces(fig, "html/1.3.c_Secchi_Depth.html")
+    write_html(
+        fig,
         config=config,
         file="html/1.3.c_Secchi_Depth.html",
         include_plotlyjs="directory",
@@ -349,8 +359,11 @@ def plot_secchi_depth(df):
 
 # get air quality data
 def get_air_quality():
-    data = get_fs_data("https://maps.trpa.org/server/rest/services/LTInfo_Monitoring/MapServer/46")
-    df = data[data["Include_in_Trend_Analysis"] == "Yes"]
+    df = get_fs_data(
+        "https://maps.trpa.org/server/rest/services/LTInfo_Monitoring/MapServer/46",
+        where="Include_in_Trend_Analysis = 'Yes'",
+        out_fields=["Pollutant", "Statistic", "Site", "Year", "Value", "Threshold_Value"],
+    )
     return df
 
 
@@ -511,7 +524,7 @@ def get_data_lake_level(days):
 
     url = f"https://waterservices.usgs.gov/nwis/iv/?format=json&sites={site_number}&parameterCd=00065&startDT={start_date_str}&endDT={end_date_str}"
 
-    response = requests.get(url)
+    response = http_client.get(url)
     data = response.json()
 
     time_series_data = data["value"]["timeSeries"][0]["values"][0]["value"]
@@ -614,7 +627,7 @@ def plot_lake_level_with_high_water_mark(df):
         yaxis=dict(title=y_title),
         xaxis=dict(title=x_title, showgrid=False),
         hovermode=hovermode,
-        template="plotly_white",
+        template=dashboard_template(),
         dragmode=False,
         legend=dict(
             orientation="h",
@@ -636,7 +649,9 @@ def plot_lake_level_with_high_water_mark(df):
         tickangle=tickangle,
     )
     # write figure to html
-    fig.write_html(
+    round_traces(fig, path_html)
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
@@ -646,7 +661,7 @@ def plot_lake_level_with_high_water_mark(df):
 
 def get_data_lake_temp():
     lakeTempURL = "https://tepfsail50.execute-api.us-west-2.amazonaws.com/v1/report/ns-station-range?rptdate=20240130&rptend=20240202&id=4"
-    response = requests.get(lakeTempURL)
+    response = http_client.get(lakeTempURL)
     df = pd.DataFrame(response.json()).reset_index()
     df["LS_Temp_Avg"] = df["LS_Temp_Avg"].astype(float)
     return df
@@ -662,7 +677,7 @@ def get_all_temp_midlake():
     for id in ids:
         lakeTempURL = f"https://tepfsail50.execute-api.us-west-2.amazonaws.com/v1/report/nasa-tb?rptdate={start}&rptend={end}&id={id}"
         # get all data from lake temp URL using f string
-        response = requests.get(lakeTempURL)
+        response = http_client.get(lakeTempURL)
         df = pd.DataFrame(response.json())
         # concat dataframes to dfMerge
         dfMerge = pd.concat([dfMerge, df])
@@ -692,7 +707,7 @@ def get_all_temp_shore():
     for id in ids:
         lakeTempURL = f"https://tepfsail50.execute-api.us-west-2.amazonaws.com/v1/report/ns-station-range?rptdate={start}&rptend={end}&id={id}"
         # get all data from lake temp URL using f string
-        response = requests.get(lakeTempURL)
+        response = http_client.get(lakeTempURL)
         df = pd.DataFrame(response.json())
         # concat dataframes to dfMerge
         dfMerge = pd.concat([dfMerge, df])
@@ -744,7 +759,18 @@ def plot_lake_temp_midlake(df):
 def get_data_precip():
     # snowlab precip data
     url = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/145"
-    data = get_fs_data(url)
+    # only years from 1987 on have data
+    data = get_fs_data(
+        url,
+        where="Year >= 1987",
+        out_fields=[
+            "Year",
+            "Full_Day_Total_Precip_mm",
+            "Pct_of_Precip_as_Snow",
+            "Pct_of_Precip_as_Rain",
+        ],
+        sync=True,
+    )
 
     # cast to float
     data["Pct_of_Precip_as_Snow"] = data["Pct_of_Precip_as_Snow"].astype(float)
@@ -775,9 +801,7 @@ def get_data_precip():
     dfYearly["% Rain"] = (dfYearly["Daily_Precip_Rain_mm"] / dfYearly["Total_Precip_mm"]) * 100
     dfYearly["% Snow"] = (dfYearly["Daily_Precip_Snow_mm"] / dfYearly["Total_Precip_mm"]) * 100
 
-    # drop all years before 1987 (no data)
-    df = dfYearly[dfYearly["Year"] >= 1987]
-    return df
+    return dfYearly
 
 
 def plot_precip(df):
@@ -821,15 +845,18 @@ def get_data_temp():
     end = datetime(2023, 12, 31)
 
     # Create Point for Lake Tahoe
-    tahoe = Point(39.0001, -120.0001, 70)
+    tahoe = meteostat.Point(39.0001, -120.0001, 70)
 
     # adjust attributes fro tahoe
     tahoe.radius = 150000
     tahoe.method = "weighted"
 
     # Get daily data for 2018
-    df = Daily(tahoe, start, end)
-    df = df.fetch()
+    df = cassette.recorded(
+        "meteostat_daily",
+        [39.0001, -120.0001, 70, tahoe.radius, tahoe.method, start, end],
+        lambda: meteostat.Daily(tahoe, start, end).fetch(),
+    )
 
     # convert all fields to farhenheit
     df = df.assign(MaxTemp=lambda x: (9 / 5) * x["tmax"] + 32)
@@ -853,13 +880,22 @@ def plot_temp(df):
         xaxis_title="Date",
         yaxis_title="Temperature (F)",
         legend_title="Temperature",
+        template=dashboard_template(),
+        # the one chart that can be zoomed, see downsample below
+        dragmode="zoom",
     )
     path_html = "html/1.2.a_TahoeTemp.html"
     div_id = "1.3.d_Precip"
-    fig.write_html(
+    # twenty years of daily points in four lines, the full series is loaded when the chart
+    # is zoomed in
+    round_traces(fig, path_html)
+    post_script = downsample(fig, max_points=500, zoom_detail=True, path_html=path_html)
+    write_html(
+        fig,
         file=path_html,
         include_plotlyjs="directory",
         div_id=div_id,
+        post_script=post_script,
     )
 
 
@@ -902,7 +938,7 @@ def plot_extremeheat(df):
         yaxis=dict(title="Days"),
         xaxis=dict(title="Year", showgrid=False),
         hovermode=hovermode,
-        template="plotly_white",
+        template=dashboard_template(),
         dragmode=False,
     )
 
@@ -914,7 +950,9 @@ def plot_extremeheat(df):
         tickangle=tickangle,
     )
     # write figure to html
-    fig.write_html(
+    round_traces(fig, path_html)
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
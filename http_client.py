@@ -0,0 +1,80 @@
+import threading
+from urllib.parse import urlsplit
+
+import cassette
+
+# (connect, read) timeouts in seconds for every request
+TIMEOUT = (10, 120)
+# keep-alive connections kept open per host
+POOL_SIZE = 8
+# requests in flight at once per host, unless overridden in HOST_LIMITS
+HOST_LIMIT = 4
+HOST_LIMITS = {
+    # purple air rate limits api keys
+    "api.purpleair.com": 1,
+}
+# retry dropped connections and gateway errors, all of our calls are reads (urllib3 Retry)
+RETRY = dict(total=3, backoff_factor=1, status_forcelist=[502, 503, 504], allowed_methods=None)
+
+# size of all response bodies received, read by stage_report
+bytes_received = 0
+
+_session = None
+_semaphores = {}
+_lock = threading.Lock()
+
+
+# One requests session shared by every data source so connections stay warm.
+# requests is imported here so a replayed or cached build never loads it.
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=Retry(**RETRY)
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Accept-Encoding"] = "gzip, deflate"
+            _session = session
+    return _session
+
+
+# Semaphore that caps concurrent requests to the host of url
+def _host_semaphore(url):
+    host = urlsplit(url).netloc
+    with _lock:
+        if host not in _semaphores:
+            _semaphores[host] = threading.BoundedSemaphore(HOST_LIMITS.get(host, HOST_LIMIT))
+    return _semaphores[host]
+
+
+# Send a request on the shared session with the default timeout and host limit,
+# or answer it from a recording when cassette.MODE is replay
+def request(method, url, **kwargs):
+    global bytes_received
+    params, data = kwargs.get("params"), kwargs.get("data")
+    kwargs.setdefault("timeout", TIMEOUT)
+    with _host_semaphore(url):
+        if cassette.MODE == "replay":
+            response = cassette.replay_response(method, url, params, data)
+        else:
+            response = get_session().request(method, url, **kwargs)
+    if cassette.MODE == "record":
+        cassette.record_response(method, url, response, params, data)
+    with _lock:
+        bytes_received += len(response.content)
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
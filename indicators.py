@@ -0,0 +1,595 @@
+import argparse
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+
+import cassette
+import stage_report
+import utils
+from built_systems import (
+    get_data_affordable_units,
+    get_data_affordable_units_by_year,
+    get_data_energy_mix,
+    get_data_home_heating,
+    get_data_low_stress_bicycle,
+    get_data_mode_share,
+    get_data_transit,
+    get_data_vehicle_miles_traveled,
+    get_deed_restricted_units,
+    plot_affordable_units,
+    plot_data_deed_restricted,
+    plot_energy_mix,
+    plot_home_heating,
+    plot_low_stress_bicycle,
+    plot_mode_share,
+    plot_transit,
+    plot_vehicle_miles_traveled,
+)
+from climate_conditions import (
+    get_air_quality,
+    get_all_temp_midlake,
+    get_data_greenhouse_gas,
+    get_data_lake_level,
+    get_data_precip,
+    get_data_purple_air,
+    get_data_purple_air_TRPA,
+    get_data_secchi_depth,
+    get_data_temp,
+    get_fire_data,
+    plot_air_quality,
+    plot_extremeheat,
+    plot_greenhouse_gas,
+    plot_lake_level_with_high_water_mark,
+    plot_lake_temp_midlake,
+    plot_precip,
+    plot_purple_air,
+    plot_purple_air_fire,
+    plot_secchi_depth,
+    plot_temp,
+)
+from natural_systems import (
+    get_areawide_data,
+    get_data_aquatic_species,
+    get_data_bmp,
+    get_data_forest_fuel,
+    get_data_restored_wetlands_meadows,
+    get_old_growth_forest,
+    get_probability_of_high_severity_fire,
+    get_veg,
+    plot_aquatic_species_bar,
+    plot_areawide,
+    plot_bmp,
+    plot_forest_fuel,
+    plot_old_growth_forest,
+    plot_probability_of_high_severity_fire,
+    plot_restored_wetlands_meadows_bar,
+    plot_veg,
+)
+from social_systems import (
+    get_data_commute_origin,
+    get_data_commute_patterns,
+    get_data_household_income,
+    get_data_housing_occupancy,
+    get_data_median_home_price,
+    get_data_race_ethnicity,
+    get_data_rent_prices,
+    get_data_tenure_by_age,
+    get_data_tenure_by_race,
+    get_data_tot_collected,
+    plot_commute_origin,
+    plot_commute_patterns,
+    plot_household_income,
+    plot_housing_occupancy,
+    plot_median_home_price,
+    plot_race_ethnicity,
+    plot_rent_prices,
+    plot_tenure_by_age,
+    plot_tenure_by_race,
+    plot_tot_collected,
+)
+
+# Build graph: node name -> (function, nodes whose results are passed to it as arguments).
+# get_* nodes download and transform the data for a chart, a node shared by several charts
+# (e.g. get_data_temp or the deed restriction layer) runs once per build.
+NODES = {
+    "get_data_greenhouse_gas": (get_data_greenhouse_gas, []),
+    "plot_greenhouse_gas": (plot_greenhouse_gas, ["get_data_greenhouse_gas"]),
+    "get_data_purple_air": (get_data_purple_air, []),
+    "plot_purple_air": (plot_purple_air, ["get_data_purple_air"]),
+    "get_data_purple_air_TRPA": (get_data_purple_air_TRPA, []),
+    "get_fire_data": (get_fire_data, []),
+    "plot_purple_air_fire": (plot_purple_air_fire, ["get_data_purple_air_TRPA", "get_fire_data"]),
+    "get_air_quality": (get_air_quality, []),
+    "plot_air_quality": (plot_air_quality, ["get_air_quality"]),
+    "get_data_temp": (get_data_temp, []),
+    "plot_extremeheat": (plot_extremeheat, ["get_data_temp"]),
+    "plot_temp": (plot_temp, ["get_data_temp"]),
+    "get_data_lake_level": (partial(get_data_lake_level, days=6300), []),
+    "plot_lake_level": (plot_lake_level_with_high_water_mark, ["get_data_lake_level"]),
+    "get_data_precip": (get_data_precip, []),
+    "plot_precip": (plot_precip, ["get_data_precip"]),
+    "get_all_temp_midlake": (get_all_temp_midlake, []),
+    "plot_lake_temp_midlake": (plot_lake_temp_midlake, ["get_all_temp_midlake"]),
+    "get_data_secchi_depth": (get_data_secchi_depth, []),
+    "plot_secchi_depth": (plot_secchi_depth, ["get_data_secchi_depth"]),
+    "get_data_forest_fuel": (get_data_forest_fuel, []),
+    "plot_forest_fuel": (plot_forest_fuel, ["get_data_forest_fuel"]),
+    "get_old_growth_forest": (get_old_growth_forest, []),
+    "plot_old_growth_forest": (plot_old_growth_forest, ["get_old_growth_forest"]),
+    "get_veg": (get_veg, []),
+    "plot_veg": (plot_veg, ["get_veg"]),
+    "get_probability_of_high_severity_fire": (get_probability_of_high_severity_fire, []),
+    "plot_probability_of_high_severity_fire": (
+        plot_probability_of_high_severity_fire,
+        ["get_probability_of_high_severity_fire"],
+    ),
+    "get_data_aquatic_species": (get_data_aquatic_species, []),
+    "plot_aquatic_species": (plot_aquatic_species_bar, ["get_data_aquatic_species"]),
+    "get_data_restored_wetlands_meadows": (get_data_restored_wetlands_meadows, []),
+    "plot_restored_wetlands_meadows": (
+        plot_restored_wetlands_meadows_bar,
+        ["get_data_restored_wetlands_meadows"],
+    ),
+    "get_data_bmp": (get_data_bmp, []),
+    "plot_bmp": (plot_bmp, ["get_data_bmp"]),
+    "get_areawide_data": (get_areawide_data, []),
+    "plot_areawide": (plot_areawide, ["get_areawide_data"]),
+    "get_deed_restricted_units": (get_deed_restricted_units, []),
+    "get_data_affordable_units": (get_data_affordable_units, ["get_deed_restricted_units"]),
+    "plot_affordable_units": (plot_affordable_units, ["get_data_affordable_units"]),
+    "get_data_affordable_units_by_year": (
+        get_data_affordable_units_by_year,
+        ["get_deed_restricted_units"],
+    ),
+    "plot_data_deed_restricted": (plot_data_deed_restricted, ["get_data_affordable_units_by_year"]),
+    "get_data_home_heating": (get_data_home_heating, []),
+    "plot_home_heating": (plot_home_heating, ["get_data_home_heating"]),
+    "get_data_energy_mix": (get_data_energy_mix, []),
+    "plot_energy_mix": (plot_energy_mix, ["get_data_energy_mix"]),
+    "get_data_transit": (get_data_transit, []),
+    "plot_transit": (plot_transit, ["get_data_transit"]),
+    "get_data_vehicle_miles_traveled": (get_data_vehicle_miles_traveled, []),
+    "plot_vehicle_miles_traveled": (
+        plot_vehicle_miles_traveled,
+        ["get_data_vehicle_miles_traveled"],
+    ),
+    "get_data_mode_share": (get_data_mode_share, []),
+    "plot_mode_share": (plot_mode_share, ["get_data_mode_share"]),
+    "get_data_low_stress_bicycle": (get_data_low_stress_bicycle, []),
+    "plot_low_stress_bicycle": (plot_low_stress_bicycle, ["get_data_low_stress_bicycle"]),
+    "get_data_household_income": (get_data_household_income, []),
+    "plot_household_income": (plot_household_income, ["get_data_household_income"]),
+    "get_data_median_home_price": (get_data_median_home_price, []),
+    "plot_median_home_price": (plot_median_home_price, ["get_data_median_home_price"]),
+    "get_data_rent_prices": (get_data_rent_prices, []),
+    "plot_rent_prices": (plot_rent_prices, ["get_data_rent_prices"]),
+    "get_data_tenure_by_age": (get_data_tenure_by_age, []),
+    "plot_tenure_by_age": (plot_tenure_by_age, ["get_data_tenure_by_age"]),
+    "get_data_housing_occupancy": (get_data_housing_occupancy, []),
+    "plot_housing_occupancy": (plot_housing_occupancy, ["get_data_housing_occupancy"]),
+    "get_data_tenure_by_race": (get_data_tenure_by_race, []),
+    "plot_tenure_by_race": (plot_tenure_by_race, ["get_data_tenure_by_race"]),
+    "get_data_commute_patterns": (get_data_commute_patterns, []),
+    "plot_commute_patterns": (plot_commute_patterns, ["get_data_commute_patterns"]),
+    "get_data_commute_origin": (get_data_commute_origin, []),
+    "plot_commute_origin": (plot_commute_origin, ["get_data_commute_origin"]),
+    "get_data_tot_collected": (get_data_tot_collected, []),
+    "plot_tot_collected": (plot_tot_collected, ["get_data_tot_collected"]),
+    "get_data_race_ethnicity": (get_data_race_ethnicity, []),
+    "plot_race_ethnicity": (plot_race_ethnicity, ["get_data_race_ethnicity"]),
+}
+
+# files written by each plot node, its html pages and the full traces a zoomable chart loads
+# when it is zoomed in (utils.downsample(zoom_detail=True)), a chart with one missing is built
+# again
+OUTPUTS = {
+    "plot_greenhouse_gas": ["1.1.a_Greenhouse_Gas.html"],
+    "plot_purple_air": ["1.2.a_Purple_Air.html"],
+    "plot_purple_air_fire": ["1.2.a_Purple_Air_v2.html"],
+    "plot_air_quality": [
+        "1.2.a_Air_Quality_CO.html",
+        "1.2.a_Air_Quality_O3.html",
+        "1.2.a_Air_Quality_PM10.html",
+        "1.2.a_Air_Quality_PM2.5.html",
+    ],
+    "plot_extremeheat": ["1.2.a_ExtremeHeatDays.html"],
+    "plot_temp": ["1.2.a_TahoeTemp.html", "1.2.a_TahoeTemp.full.json"],
+    "plot_lake_level": ["1.3.a_Lake_Level.html"],
+    "plot_precip": ["1.3.d_Precip.html"],
+    "plot_lake_temp_midlake": ["1.3.b_Lake_Temp.html"],
+    "plot_secchi_depth": ["1.3.c_Secchi_Depth.html"],
+    "plot_forest_fuel": ["2.1.a_ForestFuel.html"],
+    "plot_old_growth_forest": [
+        "2.1.b_OldGrowthForest_SeralStage.html",
+        "2.1.b_OldGrowthForest_Species.html",
+        "2.1.b_OldGrowthForest_Structure.html",
+    ],
+    "plot_veg": ["2.1.b_VegetationType.html"],
+    "plot_probability_of_high_severity_fire": ["2.1.c_Probability_of_High_Severity_Fire.html"],
+    "plot_aquatic_species": ["2.2.a_Aquatic_Species.html"],
+    "plot_restored_wetlands_meadows": ["2.3.a_Restored_Wetlands_Meadows.html"],
+    "plot_bmp": ["2.3.b_BMP.html"],
+    "plot_areawide": ["2.4.c_Areawide_Covering_Impervious.html"],
+    "plot_affordable_units": ["3.1.a_Affordable_Units.html"],
+    "plot_home_heating": ["3.1.b_HomeHeatingFuels.html"],
+    "plot_data_deed_restricted": [
+        "3.1.c_Deed_Restricted_Units_v1.html",
+        "3.1.c_Deed_Restricted_Units_v2.html",
+    ],
+    "plot_energy_mix": ["3.2.a_EnergyMix.html"],
+    "plot_transit": ["3.3.a_Transit_Ridership.html"],
+    "plot_vehicle_miles_traveled": ["3.3.b_Vehicle_Miles_Traveled.html"],
+    "plot_mode_share": ["3.3.d_Mode_Share_2.html"],
+    "plot_low_stress_bicycle": ["3.3.f_Low_Stress_Bicycle.html"],
+    "plot_household_income": [
+        "4.1.a_Household_Income_v1.html",
+        "4.1.a_Household_Income_v2.html",
+    ],
+    "plot_median_home_price": ["4.1.b_Median_Sale_Prices.html"],
+    "plot_rent_prices": ["4.1.b_Rent_Prices.html"],
+    "plot_tenure_by_age": ["4.1.c_TenureByAge.html"],
+    "plot_housing_occupancy": ["4.1.c_Occupancy.html"],
+    "plot_tenure_by_race": ["4.1.c_TenureByRace.html"],
+    "plot_commute_patterns": ["4.1.d_commuter_percentage.html"],
+    "plot_commute_origin": ["4.1.d_commuter_patterns.html"],
+    "plot_tot_collected": ["4.2.a_TOT_Collected.html"],
+    "plot_race_ethnicity": ["4.4.a_RaceEthnicity_v1.html", "4.4.a_RaceEthnicity_v2.html"],
+}
+
+# html files that aren't built from data: hand made pages and retired chart versions
+STATIC_OUTPUTS = [
+    "2.1.a_ForestFuelTreatment_Chart_option1.html",
+    "2.1.a_ForestFuelTreatment_Chart_option2.html",
+    "2.1.c_Probability_of_Low_Severity_Fire.html",
+    "3.3.d_Mode_Share_1.html",
+    "4.1.a_Household_Income_v2_old.html",
+    "4.1.e_HousingOccupancy.html",
+    "extreme-heat-days-mobile.html",
+    "extreme-heat-days.html",
+    "lake-tahoe-transit-trends.html",
+    "vehicle-miles-traveled.html",
+]
+# nodes run at once by build()
+BUILD_WORKERS = 8
+
+# hash of the data and code behind every chart in the last build, see _chart_digest
+MANIFEST_PATH = Path("data/build_manifest.json")
+HTML_DIR = Path("html")
+# result of a plot node whose inputs match the manifest, its html files are left as they are
+UNCHANGED = "unchanged"
+_source_hashes = {}
+# results of the get_* nodes from the last build, read back by render only builds
+RESULTS_DIR = Path("data/build")
+
+
+# Nodes needed to build targets, dependencies first
+def build_order(targets):
+    order = []
+
+    def visit(name):
+        if name not in order:
+            for depends_on in NODES[name][1]:
+                visit(depends_on)
+            order.append(name)
+
+    for name in targets:
+        visit(name)
+    return order
+
+
+# Call function(*args) and time it, exceptions are returned instead of raised
+def _timed_call(function, *args):
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start
+
+
+# _timed_call that also records the node in the stage report
+def _reported_call(name, function, *args):
+    rows_in = [stage_report.rows(value) for value in args]
+    rows_in = sum(rows_in) if args and None not in rows_in else None
+    with stage_report.stage(name, rows_in=rows_in) as record:
+        result, seconds = _timed_call(function, *args)
+        record["rows_out"] = stage_report.rows(result)
+        outputs = [HTML_DIR / f for f in OUTPUTS.get(name, []) if (HTML_DIR / f).exists()]
+        if outputs:
+            record["bytes_written"] = sum(path.stat().st_size for path in outputs)
+    return result, seconds
+
+
+def _save_result(name, result):
+    with utils.replacing(RESULTS_DIR / f"{name}.pkl") as temporary:
+        pd.to_pickle(result, temporary)
+
+
+def _load_result(name):
+    path = RESULTS_DIR / f"{name}.pkl"
+    if not path.exists():
+        raise RuntimeError(f"No saved data for {name}, fetch it first")
+    return pd.read_pickle(path)
+
+
+def _result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        # the worker process died or its result couldn't be sent back
+        return e, 0.0
+
+
+def _process_pool(max_workers):
+    # spawn, forking a process that has fetches running on threads isn't safe
+    context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+# Run a plot node, the charts it writes share one data file if utils.SHARED_DATA is on
+def render(name, function, *args):
+    with utils.shared_data(name):
+        return function(*args)
+
+
+# Run the nodes needed for targets (plot nodes, default everything) on a thread pool.
+# A node starts as soon as the nodes it depends on are done, and gets a copy of their results.
+# Independent downloads all run at once, http_client caps the requests to each host.
+# With render_workers the plot nodes run on a process pool of that size instead.
+# A plot node whose inputs and code hash the same as in the last build isn't run and returns
+# UNCHANGED, unless force=True or one of its html files is missing.
+# fetch_only=True runs only the get_* nodes, render_only=True runs only the plot nodes on the
+# get_* results saved by the last build that ran them.
+# report=True runs the nodes one at a time, so their timings and memory aren't mixed up,
+# and writes the stage report to stage_report.REPORT_PATH.
+# Returns {node: (result, seconds)}, a node that fails returns its exception as the result
+# and the nodes that depend on it are skipped.
+def build(
+    targets=None,
+    max_workers=BUILD_WORKERS,
+    render_workers=None,
+    force=False,
+    report=False,
+    fetch_only=False,
+    render_only=False,
+):
+    order = build_order(targets or list(OUTPUTS))
+    if fetch_only:
+        order = [name for name in order if name not in OUTPUTS]
+    if report:
+        max_workers, render_workers = 1, None
+        stage_report.start()
+    manifest = _read_manifest()
+    digests = {}
+    results = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        render_pool = _process_pool(render_workers) if render_workers else pool
+        with render_pool:
+            while len(results) < len(order):
+                for name in order:
+                    function, depends_on = NODES[name]
+                    if name in results or name in running:
+                        continue
+                    if not all(dependency in results for dependency in depends_on):
+                        continue
+                    failed = [d for d in depends_on if isinstance(results[d][0], Exception)]
+                    if failed:
+                        results[name] = (RuntimeError(f"skipped, {failed[0]} failed"), 0.0)
+                        continue
+                    args = [_copy(results[dependency][0]) for dependency in depends_on]
+                    if name in OUTPUTS:
+                        digests[name] = _chart_digest(function, args)
+                        outputs_exist = all((HTML_DIR / f).exists() for f in OUTPUTS[name])
+                        if not force and outputs_exist and manifest.get(name) == digests[name]:
+                            results[name] = (UNCHANGED, 0.0)
+                            continue
+                    executor = render_pool if name in OUTPUTS else pool
+                    if name in OUTPUTS:
+                        function = partial(render, name, function)
+                    if render_only and name not in OUTPUTS:
+                        running[name] = executor.submit(_timed_call, _load_result, name)
+                    elif report:
+                        running[name] = executor.submit(_reported_call, name, function, *args)
+                    else:
+                        running[name] = executor.submit(_timed_call, function, *args)
+                done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for name in [name for name, future in running.items() if future in done]:
+                    results[name] = _result(running.pop(name))
+                    result = results[name][0]
+                    if name not in OUTPUTS and not render_only:
+                        if not isinstance(result, Exception):
+                            _save_result(name, result)
+    _update_manifest(digests, results)
+    if report:
+        stage_report.stop()
+        stage_report.write_report()
+    return results
+
+
+def _hash_value(digest, value):
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr([(str(c), str(t)) for c, t in value.dtypes.items()]).encode("utf-8"))
+        try:
+            digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+            return
+        except TypeError:
+            # unhashable cells such as lists or geometries
+            pass
+    digest.update(pickle.dumps(value))
+
+
+def _source_hash(path):
+    if path not in _source_hashes:
+        _source_hashes[path] = hashlib.sha1(Path(path).read_bytes()).hexdigest()
+    return _source_hashes[path]
+
+
+# Hash of what a chart is built from: its input dataframes, the module the plot function is
+# in and the chart builders in utils, so a change to the data or to the chart code shows up
+def _chart_digest(function, args):
+    digest = hashlib.sha1()
+    function = getattr(function, "func", function)
+    for path in [inspect.getsourcefile(function), utils.__file__]:
+        digest.update(_source_hash(path).encode("utf-8"))
+    digest.update(function.__qualname__.encode("utf-8"))
+    # charts written in another output mode are written again
+    if utils.BINARY_ARRAYS:
+        digest.update(b"binary arrays")
+    if utils.SHARED_DATA:
+        digest.update(b"shared data")
+    for value in args:
+        _hash_value(digest, value)
+    return digest.hexdigest()
+
+
+def _read_manifest():
+    return json.loads(MANIFEST_PATH.read_text()) if MANIFEST_PATH.exists() else {}
+
+
+# Record the digests of the charts a build rendered. Builds run at once by the scheduler share
+# the manifest, so it is read again under a lock and only these charts' entries change.
+def _update_manifest(digests, results):
+    with utils.file_lock(MANIFEST_PATH):
+        manifest = _read_manifest()
+        for name, digest in digests.items():
+            if isinstance(results[name][0], Exception):
+                manifest.pop(name, None)
+            else:
+                manifest[name] = digest
+        with utils.replacing(MANIFEST_PATH) as temporary:
+            temporary.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def _copy(result):
+    return result.copy() if hasattr(result, "copy") else result
+
+
+# ok, unchanged or failed: <exception> for a build() result
+def status(result):
+    if isinstance(result, Exception):
+        return f"failed: {result!r}"
+    return UNCHANGED if isinstance(result, str) and result == UNCHANGED else "ok"
+
+
+# Plot nodes for an indicator id (1.2.a), a section (1 or 3.3), an html file, a node or all
+def plots_for(target):
+    if target == "all":
+        return list(OUTPUTS)
+    if target in OUTPUTS:
+        return [target]
+    return [
+        name
+        for name, files in OUTPUTS.items()
+        if any(f == target or f.startswith((f"{target}_", f"{target}.")) for f in files)
+    ]
+
+
+# Plot nodes for a list of plots_for targets, in order and without repeats
+def targets_for(targets):
+    nodes = []
+    for target in targets:
+        plots = plots_for(target)
+        if not plots:
+            raise ValueError(f"unknown indicator {target}")
+        nodes += [name for name in plots if name not in nodes]
+    return nodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m indicators", description="Build Climate Resilience Dashboard charts."
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        default=["all"],
+        help="indicator ids (1.2.a), sections (1, 3.3), html file names or all (the default)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=BUILD_WORKERS,
+        help=f"fetch threads and render processes, default {BUILD_WORKERS}, 1 runs nodes in turn",
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="replay recorded responses, see cassette.py"
+    )
+    parser.add_argument(
+        "--cache-only",
+        action="store_true",
+        help="use cached ArcGIS query results whatever their age, fail if one isn't cached",
+    )
+    stages = parser.add_mutually_exclusive_group()
+    stages.add_argument("--fetch-only", action="store_true", help="download data, don't render")
+    stages.add_argument(
+        "--render-only", action="store_true", help="render from the last fetched data"
+    )
+    parser.add_argument("--force", action="store_true", help="render unchanged charts too")
+    parser.add_argument(
+        "--binary-arrays",
+        action="store_true",
+        help="write trace data as base64 typed arrays, needs plotly.js 2.28 or later",
+    )
+    parser.add_argument(
+        "--shared-data",
+        action="store_true",
+        help="write each plot's trace data to one file in html/data that its charts fetch",
+    )
+    parser.add_argument(
+        "--report", action="store_true", help="write the stage timing and memory report"
+    )
+    parser.add_argument("--list", action="store_true", help="list indicator ids and files")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, files in OUTPUTS.items():
+            print(f"{name}: {', '.join(files)}")
+        return 0
+    try:
+        targets = targets_for(args.targets)
+    except ValueError as e:
+        parser.error(f"{e}, see --list")
+    if args.offline:
+        cassette.MODE = "replay"
+    if args.cache_only:
+        utils.CACHE_ONLY = True
+    if args.binary_arrays:
+        # the render processes read it from the environment
+        os.environ["DASHBOARD_BINARY_ARRAYS"] = "1"
+        utils.BINARY_ARRAYS = True
+    if args.shared_data:
+        os.environ["DASHBOARD_SHARED_DATA"] = "1"
+        utils.SHARED_DATA = True
+
+    start = time.perf_counter()
+    results = build(
+        targets,
+        max_workers=max(args.jobs, 1),
+        render_workers=args.jobs if args.jobs > 1 else None,
+        force=args.force,
+        report=args.report,
+        fetch_only=args.fetch_only,
+        render_only=args.render_only,
+    )
+    for name, (result, seconds) in sorted(results.items(), key=lambda item: -item[1][1]):
+        print(f"{seconds:8.2f}s  {name}  {status(result)}")
+    print(f"{time.perf_counter() - start:8.2f}s  total")
+    if args.report:
+        print(stage_report.summary())
+    return 1 if any(isinstance(result, Exception) for result, _ in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
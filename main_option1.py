@@ -1,54 +1,182 @@
-import datetime
+import argparse
+import json
 import logging
+import multiprocessing
 import os
-import subprocess
+import random
+import sys
 import time
+from datetime import timedelta
+from pathlib import Path
 
-from schedule import every, repeat, run_pending
-
-from climate_conditions import *
+import worker
 
 # Configure logging
-logging.basicConfig(filename="task_scheduler.log", level=logging.INFO)
+logging.basicConfig(
+    filename="task_scheduler.log",
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+)
 
+# how often each chart is rebuilt, charts not listed here are rebuilt daily
+DEFAULT_REFRESH = timedelta(days=1)
+REFRESH = {
+    # sensors that report through the day
+    "plot_purple_air": timedelta(hours=1),
+    "plot_purple_air_fire": timedelta(hours=1),
+    "plot_lake_level": timedelta(hours=3),
+    "plot_lake_temp_midlake": timedelta(hours=6),
+    # monthly totals
+    "plot_precip": timedelta(days=30),
+    "plot_transit": timedelta(days=30),
+    # census tables (MapServer/135) are updated once a year
+    "plot_household_income": timedelta(days=365),
+    "plot_tenure_by_age": timedelta(days=365),
+    "plot_tenure_by_race": timedelta(days=365),
+    "plot_housing_occupancy": timedelta(days=365),
+    "plot_race_ethnicity": timedelta(days=365),
+    "plot_home_heating": timedelta(days=365),
+}
+# a run that takes longer than this is killed
+DEFAULT_TIMEOUT = timedelta(minutes=30)
+TIMEOUT = {
+    # twenty years of daily weather station data
+    "plot_temp": timedelta(hours=1),
+    "plot_extremeheat": timedelta(hours=1),
+}
+# first runs are spread over this window so the services aren't all hit at once
+START_JITTER = timedelta(minutes=10)
+# a failed run is retried after this long, or at its normal time if that is sooner
+RETRY_AFTER = timedelta(minutes=30)
+# charts rebuilt at once
+MAX_RUNNING = 4
+# when each chart last built successfully, so a restart doesn't rebuild everything
+STATE_PATH = Path("data/scheduler_state.json")
 
-# .
-# Inside execute_task function:
-def execute_task(task_name, max_runtime, command):
-    try:
-        start_time = datetime.datetime.now()
-        # Example: Run an external command as the task
-        process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
-        process.communicate()
-        exit_code = process.returncode
-        end_time = datetime.datetime.now()
-        runtime = (end_time - start_time).total_seconds() / 3600  # Calculate runtime in hours
-        if runtime > max_runtime:
-            logging.warning(
-                f"Task '{task_name}' exceeded max runtime ({max_runtime} hours) and was terminated."
-            )
-            process.terminate()  # Terminate the task
+
+# Build one chart in a child process, the exit code tells the scheduler if it worked.
+# With use_worker the chart is built by the running worker.py, so the child only waits for it
+# and doesn't import the indicator modules, it builds the chart itself if no worker is running.
+# The worker kills the build when the chart's timeout is up, as the scheduler kills this process.
+def refresh(name, use_worker=False):
+    if use_worker:
+        timeout = TIMEOUT.get(name, DEFAULT_TIMEOUT).total_seconds()
+        try:
+            status, seconds = worker.submit([name], timeout=timeout)[name]
+        except ConnectionRefusedError:
+            logging.warning(f"No worker is running, building '{name}' in the task process")
+        except RuntimeError as e:
+            print(f"{name} failed on the worker: {e}", file=sys.stderr)
+            sys.exit(1)
         else:
-            logging.info(f"Task '{task_name}' completed in {runtime:.2f} hours.")
-            if exit_code != 0:
-                logging.error(f"Task '{task_name}' encountered an error. Exit code: {exit_code}")
-    except Exception as e:
-        logging.error(f"Error executing task '{task_name}': {str(e)}")
+            if status.startswith("failed"):
+                print(f"{name} {status}", file=sys.stderr)
+                sys.exit(1)
+            return
+    from indicators import build
+
+    # the chart's downloads run at once on build()'s thread pool
+    result, seconds = build([name])[name]
+    if isinstance(result, Exception):
+        print(f"{name} failed: {result!r}", file=sys.stderr)
+        sys.exit(1)
+
+
+def _read_state():
+    return json.loads(STATE_PATH.read_text()) if STATE_PATH.exists() else {}
+
+
+def _write_state(state):
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # written beside it and moved over it, so a crash mid write doesn't lose the state
+    # (utils.replacing, without importing pandas into the scheduler)
+    temporary = STATE_PATH.with_name(f".{STATE_PATH.name}.tmp")
+    temporary.write_text(json.dumps(state, indent=2, sort_keys=True))
+    os.replace(temporary, STATE_PATH)
 
 
-# schedule get_data_temp function to run every 15 minutes
-every(15).minutes.do(get_data_temp())
-# then schedule plot_temp to run when get_data_temp is done
-os.wait(get_data_temp())
+# Time of the first run of each chart, when it is next due plus a random delay
+def _first_runs(names, state, now):
+    first_runs = {}
+    for name in names:
+        jitter = random.uniform(0, START_JITTER.total_seconds())
+        due = state.get(name, 0) + REFRESH.get(name, DEFAULT_REFRESH).total_seconds()
+        first_runs[name] = max(due, now) + jitter
+    return first_runs
 
-# Define the schedule of the system
-every(15).minutes.do(get_data_temp())
 
-# schedule plot_temp function to wait until return of get_data_temp
-every(15).minutes.do(plot_temp())
+def run(names=None, use_worker=False):
+    from indicators import OUTPUTS
+
+    names = names or list(OUTPUTS)
+    context = multiprocessing.get_context("spawn")
+    state = _read_state()
+    next_runs = _first_runs(names, state, time.time())
+    # {name: (process, started_at)}
+    running = {}
+    logging.info(f"Scheduler started for {len(names)} charts")
+    while True:
+        now = time.time()
+        for name, (process, started_at) in list(running.items()):
+            timeout = TIMEOUT.get(name, DEFAULT_TIMEOUT).total_seconds()
+            if process.is_alive() and now - started_at > timeout:
+                process.terminate()
+                process.join(10)
+                if process.is_alive():
+                    process.kill()
+                process.join()
+                logging.warning(
+                    f"Task '{name}' exceeded max runtime ({timeout:.0f}s) and was killed."
+                )
+            elif process.is_alive():
+                continue
+            else:
+                runtime = now - started_at
+                if process.exitcode == 0:
+                    logging.info(f"Task '{name}' completed in {runtime:.1f}s.")
+                    state[name] = started_at
+                    _write_state(state)
+                else:
+                    logging.error(
+                        f"Task '{name}' failed after {runtime:.1f}s. Exit code: {process.exitcode}"
+                    )
+            if state.get(name) != started_at:
+                refresh_every = REFRESH.get(name, DEFAULT_REFRESH).total_seconds()
+                next_runs[name] = started_at + min(refresh_every, RETRY_AFTER.total_seconds())
+            del running[name]
+
+        # a chart is never started again while its last run is still going
+        due = sorted((when, name) for name, when in next_runs.items() if when <= now)
+        for when, name in due:
+            if len(running) >= MAX_RUNNING:
+                break
+            if name in running:
+                continue
+            process = context.Process(target=refresh, args=(name, use_worker), name=name)
+            process.start()
+            running[name] = (process, now)
+            next_runs[name] = now + REFRESH.get(name, DEFAULT_REFRESH).total_seconds()
+        time.sleep(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild each chart on its own schedule.")
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="indicator ids (1.2.a), sections (1, 3.3) or html file names, every chart if none",
+    )
+    parser.add_argument("--worker", action="store_true", help="build through the running worker.py")
+    args = parser.parse_args(argv)
+
+    from indicators import targets_for
+
+    try:
+        names = targets_for(args.targets)
+    except ValueError as e:
+        parser.error(f"{e}, see python -m indicators --list")
+    run(names, args.worker)
+
 
-while True:
-    run_pending()
-    time.sleep(1)
+if __name__ == "__main__":
+    main()
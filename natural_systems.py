@@ -1,13 +1,26 @@
+from io import StringIO
+
 import numpy as np
 import pandas as pd
-import plotly.express as px
 
-from utils import get_fs_data, get_fs_data_spatial, stackedbar, trendline
+import http_client
+from utils import (
+    dashboard_template,
+    get_fs_data,
+    get_fs_data_stats,
+    lazy_import,
+    round_traces,
+    stackedbar,
+    trendline,
+    write_html,
+)
+
+px = lazy_import("plotly.express")
 
 
 def get_data_forest_fuel():
     eipForestTreatments = "https://www.laketahoeinfo.org/WebServices/GetReportedEIPIndicatorProjectAccomplishments/JSON/e17aeb86-85e3-4260-83fd-a2b32501c476/19"
-    data = pd.read_json(eipForestTreatments)
+    data = pd.read_json(StringIO(http_client.get(eipForestTreatments).text))
     df = data[data["PMSubcategoryName1"] == "Treatment Zone"]
     df = df.rename(
         columns={
@@ -82,7 +95,9 @@ def plot_forest_fuel(df):
 
 def get_old_growth_forest():
     data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/Vegetation_Late_Seral/FeatureServer/0"
+        "https://maps.trpa.org/server/rest/services/Vegetation_Late_Seral/FeatureServer/0",
+        out_fields=["SeralStage", "SpatialVar", "TRPA_VegType", "Acres"],
+        categorical=True,
     )
     # df = data.groupby(["SeralStage","SpatialVar"]).agg({"Acres": "sum"}).reset_index()
     df = data[["SeralStage", "SpatialVar", "TRPA_VegType", "Acres"]]
@@ -90,7 +105,7 @@ def get_old_growth_forest():
 
 
 def plot_old_growth_forest(df):
-    seral = df.groupby("SeralStage").agg({"Acres": "sum"}).reset_index()
+    seral = df.groupby("SeralStage", observed=True).agg({"Acres": "sum"}).reset_index()
     stackedbar(
         seral,
         path_html="html/2.1.b_OldGrowthForest_SeralStage.html",
@@ -110,7 +125,7 @@ def plot_old_growth_forest(df):
         orientation=None,
         format=",.0f",
     )
-    structure = df.groupby("SpatialVar").agg({"Acres": "sum"}).reset_index()
+    structure = df.groupby("SpatialVar", observed=True).agg({"Acres": "sum"}).reset_index()
     stackedbar(
         structure,
         path_html="html/2.1.b_OldGrowthForest_Structure.html",
@@ -132,7 +147,7 @@ def plot_old_growth_forest(df):
         orientation=None,
         format=",.0f",
     )
-    species = df.groupby("TRPA_VegType").agg({"Acres": "sum"}).reset_index()
+    species = df.groupby("TRPA_VegType", observed=True).agg({"Acres": "sum"}).reset_index()
     stackedbar(
         species,
         path_html="html/2.1.b_OldGrowthForest_Species.html",
@@ -157,10 +172,12 @@ def plot_old_growth_forest(df):
 
 
 def get_probability_of_high_severity_fire():
-    highseverity = get_fs_data_spatial(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/129"
-    )
-    df = highseverity.groupby(["Name", "gridcode"])["Acres"].sum().reset_index()
+    # acres by management zone and gridcode, summed on the server
+    df = get_fs_data_stats(
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/129",
+        statistics={"Acres": "sum"},
+        group_by=["Name", "gridcode"],
+    ).dropna(subset=["Name", "gridcode"])
     df["Probability"] = np.where(
         df["gridcode"] == 1, "High Severity Fire", "Low to Moderate Severity Fire"
     )
@@ -249,7 +266,7 @@ def plot_probability_of_high_severity_fire(df):
 
 def get_data_aquatic_species():
     eipInvasive = "https://www.laketahoeinfo.org/WebServices/GetReportedEIPIndicatorProjectAccomplishments/JSON/e17aeb86-85e3-4260-83fd-a2b32501c476/15"
-    data = pd.read_json(eipInvasive)
+    data = pd.read_json(StringIO(http_client.get(eipInvasive).text))
     data = data.rename(
         columns={
             "IndicatorProjectYear": "Year",
@@ -334,7 +351,7 @@ def plot_aquatic_species_bar(df):
 
 def get_data_restored_wetlands_meadows():
     eipSEZRestored = "https://www.laketahoeinfo.org/WebServices/GetReportedEIPIndicatorProjectAccomplishments/JSON/e17aeb86-85e3-4260-83fd-a2b32501c476/9"
-    data = pd.read_json(eipSEZRestored)
+    data = pd.read_json(StringIO(http_client.get(eipSEZRestored).text))
     data = data.rename(
         columns={
             "IndicatorProjectYear": "Year",
@@ -416,18 +433,23 @@ def plot_restored_wetlands_meadows_bar(df):
 def get_data_bmp():
     # BMP map service from BMP database
     bmpsLayer = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/121"
-    # get data from map service
-    data = get_fs_data(bmpsLayer)
-    # select rows where BMPs CertificateIssued = 1 (True)
-    data.loc[data["CertificateIssued"] == 1]
+    # certificate dates only, counted by year here, grouping on the server gives one group per
+    # distinct date, more than the layer returns in one response
+    data = get_fs_data(
+        bmpsLayer, where="CertDate IS NOT NULL", out_fields=["CertDate"], paginate=True
+    )
     # create Year column
     data["Year"] = pd.DatetimeIndex(data["CertDate"]).year
     # total bmps certified by year
-    bmpsCertByYear = data.groupby("Year")["OBJECTID"].count().reset_index()
+    bmpsCertByYear = data.groupby("Year").size().reset_index(name="OBJECTID")
     # total developed parcel rows
-    parcelsDeveloped = data.loc[~data["EXISTING_LANDUSE"].isin(["Vacant", "Open Space"])]
+    parcelsDeveloped = get_fs_data_stats(
+        bmpsLayer,
+        statistics={"OBJECTID": "count"},
+        where="EXISTING_LANDUSE IS NULL OR EXISTING_LANDUSE NOT IN ('Vacant', 'Open Space')",
+    )
     # set total developed parcels field
-    bmpsCertByYear["Developed Parcels"] = parcelsDeveloped["OBJECTID"].count()
+    bmpsCertByYear["Developed Parcels"] = parcelsDeveloped["OBJECTID"].iloc[0]
     # cumulative sum of BMPs installed per year
     bmpsCertByYear["Developed Parcels with BMPs"] = bmpsCertByYear["OBJECTID"].cumsum()
     # BMPs installed per year compared to total developed parcels per year
@@ -477,15 +499,18 @@ def plot_bmp(df):
 def get_areawide_data():
     # areawide overlay URL
     areawideOverlay = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/140"
-    # get data from map service
-    data = get_fs_data(areawideOverlay)
-    # summarize total area of Surface = Hard Surface
-    df = data.loc[data["Surface"] == "Hard"]
+    # summarize the area of hard surface by status and year on the server
+    df = get_fs_data_stats(
+        areawideOverlay,
+        statistics={"Acres": "sum"},
+        group_by=["Status", "Year_Completed"],
+        where="Surface = 'Hard'",
+    )
     # calculate total acres
     total_acres = df["Acres"].sum()
     # summarize the area of hard surface covered by status = completed or active
-    sdf_impervious_hard_summary = (
-        df.groupby(["Status", "Year_Completed"])["Acres"].sum().reset_index()
+    sdf_impervious_hard_summary = df.dropna(subset=["Status", "Year_Completed"]).reset_index(
+        drop=True
     )
     # sort years
     sdf_impervious_hard_summary = sdf_impervious_hard_summary.sort_values(by="Year_Completed")
@@ -546,9 +571,12 @@ def plot_areawide(df):
 
 
 def get_veg():
-    dfVeg = get_fs_data("https://maps.trpa.org/server/rest/services/LTInfo_Monitoring/MapServer/91")
-    # selecvegetation
-    df = dfVeg.loc[(dfVeg["Development"] == "Undeveloped")]
+    # select undeveloped vegetation
+    df = get_fs_data(
+        "https://maps.trpa.org/server/rest/services/LTInfo_Monitoring/MapServer/91",
+        where="Development = 'Undeveloped'",
+        out_fields=["TRPA_VegType", "SUM_Acres"],
+    )
 
     # change name SUM_Acres to Acres
     df = df.rename(columns={"SUM_Acres": "Acres"})
@@ -646,7 +674,7 @@ def plot_veg(df):
         # yaxis=dict(tickformat=format, hoverformat=format, title=y_title),
         # xaxis=dict(title=x_title),
         hovermode=hovermode,
-        template="plotly_white",
+        template=dashboard_template(),
         dragmode=False,
         legend_title=None,
         legend=dict(
@@ -663,7 +691,9 @@ def plot_veg(df):
     fig.update_xaxes(tickformat=".0f")
     fig.update_layout(additional_formatting)
 
-    fig.write_html(
+    round_traces(fig, path_html)
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
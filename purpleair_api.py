@@ -4,16 +4,19 @@ import json
 import time
 
 import pandas as pd
-import requests as rq
 from tqdm import tqdm
 
+import http_client
+
 # Insert API key here
 api_key = "INSERT API KEY HERE"
 
 
 def check_api_key(api_key=api_key):
     """Function to check if the API Key being used is valid"""
-    key_check = rq.get("https://api.purpleair.com/v1/keys", params={"api_key": api_key}).json()
+    key_check = http_client.get(
+        "https://api.purpleair.com/v1/keys", params={"api_key": api_key}
+    ).json()
     try:
         if key_check["error"]:
             print("Invalid key")
@@ -29,7 +32,7 @@ tahoe_bbox = {"xmax": -119.91367, "ymax": 39.27833, "xmin": -120.18534, "ymin":
 
 def get_sensor_list(bbox):
     """Function to create list of all sensors in a bounding box"""
-    sensor_list = rq.get(
+    sensor_list = http_client.get(
         "https://api.purpleair.com/v1/sensors",
         headers={"X-API-Key": api_key},
         params={
@@ -62,12 +65,12 @@ def get_sensor_list(bbox):
 
 
 # sensor_list = get_sensor_list(tahoe_bbox)
-sensor_list = pd.read_csv("data/PurpleAir/bbox_sensor_table2024-02-01_13:19.csv")
+sensor_list = pd.read_csv("data/PurpleAir/bbox_sensor_table2024-02-01.csv")
 
 
 def get_sensor_year_data(api_fields, sensor_index, start_timetuple, end_timetuple, api_key=api_key):
     """Function to make single API call. Start and end (year, month) as tuple"""
-    sensor_year = rq.get(
+    sensor_year = http_client.get(
         f"https://api.purpleair.com/v1/sensors/{sensor_index}/history",
         headers={"X-API-Key": api_key},
         params={
@@ -2,28 +2,35 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import plotly.express as px
 
 from utils import (
     create_stacked_bar_plot_with_dropdown,
+    dashboard_template,
     get_fs_data,
+    get_fs_data_stats,
     groupedbar_percent,
+    lazy_import,
     read_file,
+    round_traces,
     stackedbar,
     trendline,
+    write_html,
 )
 
+px = lazy_import("plotly.express")
+
 # import pydeck
 
 
 # get data for household income
 def get_data_household_income():
-    data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135"
-    )
     # get only household income data
-    df = data.loc[(data["Category"] == "Household Income")].copy()
-    df = df[df["Geography"].isin(["Basin", "South Lake", "North Lake"])]
+    df = get_fs_data(
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135",
+        where="Category = 'Household Income' AND Geography IN ('Basin', 'South Lake', 'North Lake')",
+        out_fields=["year_sample", "value", "Geography"],
+        paginate=True,
+    )
     df["Geography"] = df["Geography"].replace({"Basin": "Lake Tahoe Region"})
     df = df.rename(columns={"year_sample": "Year"})
     return df
@@ -137,7 +144,7 @@ def calculate_data_median_home_price(start_date, end_date):
 # get data for median home price
 def get_data_median_home_price():
     url = "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/147"
-    data = get_fs_data(url)
+    data = get_fs_data(url, out_fields=["month_year", "Purchase_Amt"])
     # convert month and year to datetime
     data["month_year"] = pd.to_datetime(data["month_year"])
     data["year"] = data["month_year"].dt.year
@@ -243,18 +250,13 @@ def plot_rent_prices(df):
 # get tenure by age data
 def get_data_tenure_by_age():
     data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135"
-    )
-    mask = (
-        (data["Category"] == "Tenure by Age")
-        & (data["year_sample"] == 2024)
-        & (data["Geography"].isin(["Basin", "South Lake", "North Lake"]))
-    )
-    val = (
-        data[mask]
-        .loc[:, ["variable_name", "value", "Geography"]]
-        .rename(columns={"variable_name": "Age"})
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135",
+        where="Category = 'Tenure by Age' AND year_sample = 2024 "
+        "AND Geography IN ('Basin', 'South Lake', 'North Lake')",
+        out_fields=["variable_name", "value", "Geography"],
+        paginate=True,
     )
+    val = data.rename(columns={"variable_name": "Age"})
     val["Tenure"] = np.where(
         val["Age"].str.startswith("Owner"), "Owner Occupied", "Renter Occupied"
     )
@@ -349,15 +351,13 @@ def plot_tenure_by_age(df):
 
 # get tenure by race data
 def get_data_tenure_by_race():
-    data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135"
-    )
-    mask = (
-        (data["Category"] == "Tenure by Race")
-        & (data["year_sample"] == 2024)
-        & (data["Geography"].isin(["Basin", "South Lake", "North Lake"]))
+    val = get_fs_data(
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135",
+        where="Category = 'Tenure by Race' AND year_sample = 2024 "
+        "AND Geography IN ('Basin', 'South Lake', 'North Lake')",
+        out_fields=["variable_name", "value", "Geography"],
+        paginate=True,
     )
-    val = data[mask].loc[:, ["variable_name", "value", "Geography"]]
     val["Race"] = val["variable_name"].replace(
         {
             "Owner Occupied: Asian Alone Householder": "Asian",
@@ -433,11 +433,12 @@ def plot_tenure_by_race(df):
 
 
 def get_data_housing_occupancy():
-    data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135"
+    val = get_fs_data(
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135",
+        where="Category = 'Housing Units: Occupancy'",
+        out_fields=["variable_name", "value", "Geography", "year_sample"],
+        paginate=True,
     )
-    mask = data["Category"] == "Housing Units: Occupancy"
-    val = data[mask].loc[:, ["variable_name", "value", "Geography", "year_sample"]]
     val = val.groupby(["variable_name", "Geography", "year_sample"]).sum().reset_index()
 
     # Need to get vacant other from total housing units: vacant and
@@ -516,7 +517,8 @@ def plot_housing_occupancy(df):
 # get commute patterns data
 def get_data_commute_patterns():
     data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/141"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/141",
+        out_fields=["Year", "category", "S000"],
     )
     grouped_df = data.groupby(["Year", "category"], as_index=False).agg({"S000": "sum"})
     processed_df = grouped_df.pivot(index="Year", columns="category", values="S000").reset_index()
@@ -556,13 +558,15 @@ def plot_commute_patterns(df):
         yaxis=dict(title=y_title),
         xaxis=dict(title=x_title),
         hovermode="x",
-        template="plotly_white",
+        template=dashboard_template(),
         dragmode=False,
         yaxis_range=[y_min, y_max],
     )
     fig.update_traces(hovertemplate="%{y:,.0f}")
     fig.update_yaxes(tickformat=",.0f")
-    fig.write_html(
+    round_traces(fig, path_html)
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
@@ -572,8 +576,23 @@ def plot_commute_patterns(df):
 
 # get commute origin data
 def get_data_commute_origin():
+    # 2021 commutes from outside the basin to work in the basin
     data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/141"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/141",
+        where="Year = 2021 AND h_tract_TRPAID = 'Outside Basin' "
+        "AND w_tract_TRPAID <> 'Outside Basin'",
+        out_fields=[
+            "Year",
+            "category",
+            "S000",
+            "h_tract_id",
+            "h_tract_lat",
+            "h_tract_long",
+            "h_tract_TRPAID",
+            "w_tract_lat",
+            "w_tract_long",
+            "w_tract_TRPAID",
+        ],
     )
     reno_census_tracts = read_file("data/Reno_Census_Tracts.csv")
     reno_census_tracts["FIPS"] = reno_census_tracts["FIPS"].astype(str)
@@ -633,10 +652,12 @@ def plot_commute_origin(df):
 
 # get TOT data
 def get_data_tot_collected():
-    df = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/137"
-    )
-    df_grouped = df.groupby(["Fiscal_Year", "Jurisdiction"], as_index=False)["TOT_Collected"].sum()
+    # TOT collected by fiscal year and jurisdiction, summed on the server
+    df_grouped = get_fs_data_stats(
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/137",
+        statistics={"TOT_Collected": "sum"},
+        group_by=["Fiscal_Year", "Jurisdiction"],
+    ).dropna(subset=["Fiscal_Year", "Jurisdiction"])
     df_grouped["FY_Formatted"] = df_grouped["Fiscal_Year"].str.replace("-", "/")
     drop_year = [
         "2006/07",
@@ -695,16 +716,18 @@ def plot_tot_collected(df):
 # get race and ethinicity data
 def get_data_race_ethnicity():
     data = get_fs_data(
-        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135"
+        "https://maps.trpa.org/server/rest/services/LTinfo_Climate_Resilience_Dashboard/MapServer/135",
+        where="Category = 'Race and Ethnicity' AND (dataset IS NULL OR dataset <> 'acs/acs5')",
+        out_fields=["variable_name", "value", "Geography", "year_sample"],
+        paginate=True,
     )
-    mask1 = (data["Category"] == "Race and Ethnicity") & (data["dataset"] != "acs/acs5")
     # mask2 = (
     #     (data["Category"] == "Race and Ethnicity")
     #     & (data["year_sample"] == 2020)
     #     & (data["sample_level"] == "block group")
     #     & (data['dataset'] != 'acs/acs5' )
     # )
-    val = data[mask1]
+    val = data
     # df2 = data[mask2]
     # val = pd.concat([df1, df2], ignore_index=True)
     val = val.loc[:, ["variable_name", "value", "Geography", "year_sample"]].rename(
@@ -0,0 +1,102 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+import http_client
+
+# Per-stage wall time, cpu time, rows, bytes and memory of a build, see indicators.build(report=True)
+REPORT_PATH = Path("data/build_report.json")
+# stages listed in the summary
+TOP_N = 10
+
+enabled = False
+_records = []
+# stages that are running, innermost last
+_stack = []
+
+
+# Start recording stages, tracemalloc slows everything down so this is only on for a report
+def start():
+    global enabled
+    _records.clear()
+    _stack.clear()
+    enabled = True
+    tracemalloc.start()
+
+
+def stop():
+    global enabled
+    enabled = False
+    tracemalloc.stop()
+
+
+def rows(value):
+    return len(value) if hasattr(value, "columns") else None
+
+
+# Record one stage. The yielded dict takes rows_out and bytes_written from the caller,
+# bytes_downloaded counts the responses received through http_client during the stage.
+# Stages nest (a plot node calls a chart builder) but must not run on several threads at once.
+@contextmanager
+def stage(name, rows_in=None):
+    if not enabled:
+        yield {}
+        return
+    record = dict(stage=name, rows_in=rows_in, rows_out=None, bytes_written=None)
+    current, peak = tracemalloc.get_traced_memory()
+    if _stack:
+        # keep the enclosing stage's peak before resetting it
+        _stack[-1]["_peak"] = max(_stack[-1].get("_peak", 0), peak)
+    _stack.append(record)
+    tracemalloc.reset_peak()
+    received = http_client.bytes_received
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - wall, 4)
+        record["cpu_seconds"] = round(time.process_time() - cpu, 4)
+        record["bytes_downloaded"] = http_client.bytes_received - received
+        peak = max(tracemalloc.get_traced_memory()[1], record.pop("_peak", 0))
+        record["peak_memory_bytes"] = peak - current
+        _stack.pop()
+        if _stack:
+            _stack[-1]["_peak"] = max(_stack[-1].get("_peak", 0), peak)
+        _records.append(record)
+
+
+# Decorator for the chart builders in utils, which all take (df, path_html, ...)
+def profiled(builder):
+    @wraps(builder)
+    def wrapper(df, path_html, *args, **kwargs):
+        with stage(f"{builder.__name__} {Path(path_html).name}", rows_in=rows(df)) as record:
+            result = builder(df, path_html, *args, **kwargs)
+            if enabled and Path(path_html).exists():
+                record["bytes_written"] = Path(path_html).stat().st_size
+        return result
+
+    return wrapper
+
+
+def write_report(path=None):
+    path = Path(path or REPORT_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report = dict(created=datetime.now().isoformat(timespec="seconds"), stages=_records)
+    path.write_text(json.dumps(report, indent=2))
+
+
+# The slowest stages of the last report, one line each
+def summary(top=TOP_N):
+    lines = [f"{'wall s':>8} {'cpu s':>8} {'rows in':>9} {'rows out':>9} {'MB peak':>8}  stage"]
+    for record in sorted(_records, key=lambda r: -r["wall_seconds"])[:top]:
+        lines.append(
+            f"{record['wall_seconds']:8.2f} {record['cpu_seconds']:8.2f}"
+            f" {record['rows_in'] if record['rows_in'] is not None else '':>9}"
+            f" {record['rows_out'] if record['rows_out'] is not None else '':>9}"
+            f" {record['peak_memory_bytes'] / 1e6:8.1f}  {record['stage']}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+import utils
+
+
+def test_lttb_keeps_ends_and_peaks():
+    x = np.arange(100)
+    y = np.zeros(100)
+    y[[17, 42, 81]] = [5, -7, 9]
+    indices = utils.lttb(x, y, 10)
+    assert len(indices) == 10
+    assert indices[0] == 0 and indices[-1] == 99
+    assert (np.diff(indices) > 0).all()
+    assert {17, 42, 81} <= set(indices)
+
+
+def test_lttb_short_input_is_unchanged():
+    assert utils.lttb(range(5), range(5), 10).tolist() == [0, 1, 2, 3, 4]
+    assert utils.lttb(range(5), range(5), 2).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_lttb_missing_bucket_keeps_first_point():
+    y = np.arange(50, dtype=float)
+    y[:20] = np.nan
+    indices = utils.lttb(np.arange(50), y, 6)
+    assert len(indices) == 6
+    # the first bucket, points 1 to 12, is all missing
+    assert indices[1] == 1
+
+
+def test_trendline_zoom_detail_can_zoom(tmp_path, monkeypatch):
+    written = {}
+    monkeypatch.setattr(
+        utils, "write_html", lambda fig, **kwargs: written.update(fig=fig, **kwargs)
+    )
+    df = pd.DataFrame({"Day": np.arange(100), "Value": np.sin(np.arange(100) / 5)})
+    path_html = tmp_path / "chart.html"
+    utils.trendline(
+        df,
+        path_html=str(path_html),
+        div_id="chart",
+        x="Day",
+        y="Value",
+        color=None,
+        color_sequence=None,
+        sort="Day",
+        orders=None,
+        x_title="Day",
+        y_title="Value",
+        format=",.1f",
+        hovertemplate="%{y:,.1f}",
+        markers=False,
+        hover_data=None,
+        tickvals=None,
+        ticktext=None,
+        tickangle=None,
+        hovermode="x unified",
+        custom_data=None,
+        max_points=20,
+        zoom_detail=True,
+    )
+    assert written["fig"].layout.dragmode == "zoom"
+    assert len(written["fig"].data[0].y) == 20
+    assert "chart.full.json" in written["post_script"]
+    assert (tmp_path / "chart.full.json").exists()
@@ -0,0 +1,112 @@
+import json
+
+import pandas as pd
+import pytest
+
+import utils
+
+CHART = dict(x="Year", y="Value", hovertemplate="%{y:,.0f}", hovermode="x unified")
+
+
+@pytest.fixture
+def df():
+    rows = [
+        (year, category, geography, value)
+        for year, values in [(2019, [10, 20, 30]), (2020, [15, 5, 40]), (2021, [12, 25, 33])]
+        for geography in ["Lake Tahoe Region", "California"]
+        for category, value in zip(["B", "A", "C"], values)
+    ]
+    return pd.DataFrame(rows, columns=["Year", "Category", "Geography", "Value"])
+
+
+def trendline(df, path_html):
+    utils.trendline(
+        df[df["Geography"] == "Lake Tahoe Region"],
+        path_html=path_html,
+        div_id="chart",
+        color="Category",
+        color_sequence=None,
+        sort="Year",
+        orders=None,
+        x_title="Year",
+        y_title="Value",
+        format=",.0f",
+        markers=True,
+        hover_data=None,
+        tickvals=None,
+        ticktext=None,
+        tickangle=None,
+        custom_data=None,
+        **CHART,
+    )
+
+
+def stackedbar(df, path_html):
+    utils.stackedbar(
+        df[df["Geography"] == "Lake Tahoe Region"],
+        path_html=path_html,
+        div_id="chart",
+        color="Category",
+        color_sequence=["#023f64", "#7ebfb5", "#a48352"],
+        orders={"Category": ["C", "B", "A"]},
+        y_title="Value",
+        x_title="Year",
+        custom_data=None,
+        format=",.0f",
+        **CHART,
+    )
+
+
+def groupedbar_percent(df, path_html):
+    utils.groupedbar_percent(
+        df,
+        path_html=path_html,
+        div_id="chart",
+        facet="Geography",
+        color="Category",
+        color_sequence=None,
+        orders=None,
+        y_title="Value",
+        x_title="Year",
+        format=".0%",
+        **CHART,
+    )
+
+
+# json without empty objects, plotly express writes some settings as {}
+def pruned(value):
+    if isinstance(value, dict):
+        return {key: pruned(v) for key, v in value.items() if v != {}}
+    if isinstance(value, list):
+        return [pruned(v) for v in value]
+    return value
+
+
+# Figure json the builder would write, without the template: plotly express sets some of
+# the dashboard template's layout on the figure itself
+def figure_json(build, df, monkeypatch, fast):
+    figures = []
+    monkeypatch.setattr(utils, "FAST_BUILDERS", fast)
+    monkeypatch.setattr(utils, "write_html", lambda fig, *args, **kwargs: figures.append(fig))
+    build(df, "chart.html")
+    figure = json.loads(figures[0].to_json())
+    figure["layout"].pop("template", None)
+    for key, value in utils.TEMPLATE_LAYOUT.items():
+        if figure["layout"].get(key) == value:
+            del figure["layout"][key]
+    return pruned(figure)
+
+
+@pytest.mark.parametrize("build", [trendline, stackedbar, groupedbar_percent])
+def test_fast_figure_matches_plotly_express(build, df, monkeypatch):
+    assert figure_json(build, df, monkeypatch, fast=True) == figure_json(
+        build, df, monkeypatch, fast=False
+    )
+
+
+def test_fast_path_falls_back_to_plotly_express(df):
+    assert utils._fast_path(df, "Year", "Value", "Category")
+    # hover_data, a numeric color on bars and horizontal bars aren't drawn by _fast_figure
+    assert not utils._fast_path(df, "Year", "Value", "Category", hover_data=["Geography"])
+    assert not utils._fast_path(df, "Category", "Value", "Year")
+    assert not utils._fast_path(df, "Value", "Category")
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+
+URL = "https://maps.trpa.org/server/rest/services/Test/MapServer/0"
+# rows the test layer returns per request
+LIMIT = 10
+
+
+def test_decode_features_types():
+    result = {
+        "fields": [
+            {"name": "OBJECTID", "type": "esriFieldTypeOID"},
+            {"name": "Year", "type": "esriFieldTypeSmallInteger"},
+            {"name": "Count", "type": "esriFieldTypeInteger"},
+            {"name": "Value", "type": "esriFieldTypeDouble"},
+            {"name": "Date", "type": "esriFieldTypeDate"},
+            {"name": "Name", "type": "esriFieldTypeString"},
+        ],
+        "features": [
+            {
+                "attributes": {
+                    "OBJECTID": 1,
+                    "Year": 2020,
+                    "Count": 5,
+                    "Value": 1.5,
+                    "Date": 1577836800000,
+                    "Name": "a",
+                }
+            },
+            {
+                "attributes": {
+                    "OBJECTID": 2,
+                    "Year": 2021,
+                    "Count": None,
+                    "Value": None,
+                    "Date": None,
+                    "Name": "b",
+                }
+            },
+        ],
+    }
+    df = utils.decode_features(result)
+    assert list(df.columns) == ["OBJECTID", "Year", "Count", "Value", "Date", "Name"]
+    assert df["OBJECTID"].dtype == "int64"
+    assert df["Year"].tolist() == [2020, 2021]
+    # nulls in an integer field keep it integer
+    assert df["Count"].dtype == "Int64"
+    assert df["Count"].isna().tolist() == [False, True]
+    assert np.isnan(df["Value"][1])
+    assert df["Date"][0] == pd.Timestamp("2020-01-01")
+    assert pd.isna(df["Date"][1])
+    assert df["Name"].tolist() == ["a", "b"]
+
+
+def test_decode_features_schema_fallback_and_categories():
+    result = {
+        "features": [{"attributes": {"Year": 2020, "Name": "a"}} for _ in range(4)],
+    }
+    df = utils.decode_features(
+        result, field_types={"Year": "esriFieldTypeInteger"}, categorical=True
+    )
+    assert df["Year"].dtype == "int64"
+    assert isinstance(df["Name"].dtype, pd.CategoricalDtype)
+
+
+def test_decode_features_empty():
+    assert utils.decode_features({"features": []}).empty
+
+
+@pytest.fixture
+def server(monkeypatch):
+    rows = [{"OBJECTID": i, "Value": float(i)} for i in range(1, 26)]
+    info = {
+        "objectIdField": "OBJECTID",
+        "maxRecordCount": LIMIT,
+        "advancedQueryCapabilities": {"supportsPagination": True},
+        "fields": [
+            {"name": "OBJECTID", "type": "esriFieldTypeOID"},
+            {"name": "Value", "type": "esriFieldTypeDouble"},
+        ],
+    }
+    queries = []
+
+    # a layer that returns at most LIMIT rows per request
+    def query_json(service_url, params):
+        queries.append(params)
+        if params.get("returnCountOnly"):
+            return {"count": len(rows)}
+        offset = params.get("resultOffset", 0)
+        page = rows[offset : offset + min(params.get("resultRecordCount", LIMIT), LIMIT)]
+        return {
+            "features": [{"attributes": row} for row in page],
+            "exceededTransferLimit": offset + len(page) < len(rows),
+        }
+
+    monkeypatch.setattr(utils, "_get_layer_info", lambda url: info)
+    monkeypatch.setattr(utils, "_query_json", query_json)
+    return info, queries
+
+
+def test_query_layer_pages_past_the_transfer_limit(server):
+    df = utils._query_layer(URL)
+    assert df["OBJECTID"].tolist() == list(range(1, 26))
+
+
+def test_query_layer_paged_raises_on_a_short_page(server):
+    info, _ = server
+    # the layer reports a larger limit than it applies, so the one page it asks for is cut short
+    info["maxRecordCount"] = 30
+    with pytest.raises(utils.TransferLimitExceeded):
+        utils._query_layer_paged(URL)
+
+
+def test_query_stats_raises_when_groups_are_cut_short(server):
+    # one group per row, more groups than one response holds and no paging of aggregates
+    with pytest.raises(utils.TransferLimitExceeded):
+        utils._query_stats(URL, "1=1", ["OBJECTID"], {"Value": "sum"})
@@ -0,0 +1,66 @@
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+import utils
+
+URL = "https://maps.trpa.org/server/rest/services/Test/MapServer/0"
+
+
+@pytest.fixture
+def layer(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "SYNC_DIR", tmp_path)
+    monkeypatch.setattr(
+        utils,
+        "_get_layer_info",
+        lambda url: {"objectIdField": "OBJECTID", "editFieldsInfo": {"editDateField": "Edited"}},
+    )
+    rows = pd.DataFrame(
+        {
+            "OBJECTID": [1, 2, 3],
+            "Value": [10.0, 20.0, 30.0],
+            "Edited": [1_000, 1_000, 1_000],
+        }
+    )
+    queries = []
+
+    def query(service_url, where, out_fields, return_geometry, max_workers):
+        queries.append(where)
+        if where == "1=1":
+            return rows.copy()
+        # a delta query, rows added or edited since the last sync
+        return rows[(rows["OBJECTID"] > 3) | (rows["Edited"] > 1_000)].copy()
+
+    monkeypatch.setattr(utils, "_query_layer_paged", query)
+    return rows, queries
+
+
+def test_sync_layer_merges_delta(layer):
+    rows, queries = layer
+    first = utils._sync_layer(URL)
+    assert first["OBJECTID"].tolist() == [1, 2, 3]
+
+    # row 2 is edited and row 4 added on the server
+    rows.loc[1, ["Value", "Edited"]] = [25.0, 2_000]
+    rows.loc[3] = [4, 40.0, 2_000]
+    second = utils._sync_layer(URL)
+    assert queries[0] == "1=1"
+    assert queries[1].startswith("(1=1) AND (OBJECTID > 3 OR Edited > TIMESTAMP")
+    assert second["OBJECTID"].tolist() == [1, 2, 3, 4]
+    assert second["Value"].tolist() == [10.0, 25.0, 30.0, 40.0]
+
+
+def test_sync_layer_reconciles(layer, monkeypatch):
+    rows, queries = layer
+    utils._sync_layer(URL)
+    rows.drop(index=0, inplace=True)
+    monkeypatch.setattr(utils, "SYNC_RECONCILE_EVERY", timedelta(0))
+    assert utils._sync_layer(URL)["OBJECTID"].tolist() == [2, 3]
+    assert queries == ["1=1", "1=1"]
+
+
+def test_sync_layer_returns_requested_fields(layer):
+    # the high-water mark fields are synced but not returned, the result shares its cache
+    # entry with the plain query
+    assert utils._sync_layer(URL, out_fields="Value").columns.tolist() == ["Value"]
@@ -1,12 +1,53 @@
-from datetime import datetime
+import base64
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import pytz
-from arcgis.features import FeatureLayer
+
+import cassette
+import http_client
+from stage_report import profiled
+
+
+# Stand-in for a module that is imported the first time one of its attributes is used.
+# arcgis, plotly and meteostat take seconds to import and most entry points
+# (the CLI's --list, the scheduler, fetch-only builds) never touch them.
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+px = lazy_import("plotly.express")
+go = lazy_import("plotly.graph_objects")
+pytz = lazy_import("pytz")
+# importing arcgis.features also registers the dataframe .spatial accessor
+features = lazy_import("arcgis.features")
+geometry = lazy_import("arcgis.geometry")
 
 
 # Reads in csv file
@@ -17,42 +58,584 @@ def read_file(path_file):
     return data
 
 
-# Gets data with query from the TRPA server
-def get_fs_data_query(service_url, query_params):
-    feature_layer = FeatureLayer(service_url)
-    query_result = feature_layer.query(query_params)
-    # Convert the query result to a list of dictionaries
-    feature_list = query_result.features
-    # Create a pandas DataFrame from the list of dictionaries
-    all_data = pd.DataFrame([feature.attributes for feature in feature_list])
-    # return data frame
+# Yields a temporary path next to path that replaces it when the block finishes, so readers
+# never see a half written file and two processes writing the same file leave one whole copy
+@contextmanager
+def replacing(path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    finally:
+        temporary.unlink(missing_ok=True)
+
+
+# Exclusive lock on path, held against other processes (the scheduler's task processes, the
+# worker) as well as other threads, through a path.lock file next to it.
+# Raises TimeoutError if it isn't free within FILE_LOCK_TIMEOUT.
+@contextmanager
+def file_lock(path):
+    lock_path = Path(f"{path}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with _file_locks_guard:
+        thread_lock = _file_locks.setdefault(str(lock_path), threading.Lock())
+    timeout = FILE_LOCK_TIMEOUT.total_seconds()
+    if not thread_lock.acquire(timeout=timeout):
+        raise TimeoutError(f"{lock_path} is still locked after {timeout:.0f}s")
+    try:
+        with open(lock_path, "a+b") as f:
+            if os.name == "nt":
+                import msvcrt
+
+                def lock():
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+                def unlock():
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+            else:
+                import fcntl
+
+                def lock():
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+                def unlock():
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    lock()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(
+                            f"{lock_path} is still locked after {timeout:.0f}s"
+                        ) from None
+                    time.sleep(FILE_LOCK_POLL)
+            try:
+                yield
+            finally:
+                unlock()
+    finally:
+        thread_lock.release()
+
+
+# how long file_lock waits for another process, a sync of a large layer holds its lock for
+# the whole download
+FILE_LOCK_TIMEOUT = timedelta(hours=1)
+# seconds between attempts to take a file lock
+FILE_LOCK_POLL = 0.1
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+# Cache directory and time-to-live for ArcGIS query results
+CACHE_DIR = Path("data/cache")
+CACHE_TTL_DEFAULT = timedelta(days=1)
+# per-layer overrides, keyed on the layer path after /rest/services/
+CACHE_TTL = {
+    # census table changes a few times a year
+    "LTinfo_Climate_Resilience_Dashboard/MapServer/135": timedelta(days=30),
+    # purple air table is appended to throughout the day
+    "LTinfo_Climate_Resilience_Dashboard/MapServer/143": timedelta(hours=1),
+    # bike lanes and late seral forest are updated rarely
+    "Transportation/MapServer/3": timedelta(days=7),
+    "Vegetation_Late_Seral/FeatureServer/0": timedelta(days=30),
+}
+# number of pages fetched at once by paginated queries
+FETCH_WORKERS = 4
+# local copies of growing layers that are refreshed with deltas, see _sync_layer
+SYNC_DIR = Path("data/sync")
+# how often a synced layer is downloaded in full to pick up deleted rows
+SYNC_RECONCILE_EVERY = timedelta(days=7)
+# serve cached results whatever their age and never query the server, see cached_query
+CACHE_ONLY = False
+# in-process memo in front of the on-disk cache: {key: (fetched_at, dataframe, bytes)},
+# least recently used first. Results are dropped from it once it holds more than
+# MEMO_MAX_BYTES, which matters in a long running process such as the build child of worker.py.
+MEMO_MAX_BYTES = 512 * 2**20
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+# one lock per cache key so concurrent callers of the same query share one download
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+# Build the cache key for a query
+def _cache_key(service_url, where="1=1", out_fields="*", return_geometry=False):
+    if not isinstance(out_fields, str):
+        out_fields = ",".join(out_fields)
+    return (service_url.rstrip("/"), where or "1=1", out_fields or "*", bool(return_geometry))
+
+
+# Layer path after /rest/services/, e.g. Transportation/MapServer/3
+def _layer_path(service_url):
+    return service_url.rstrip("/").split("/rest/services/")[-1]
+
+
+# Readable prefix for the cache files of a layer, e.g. Transportation_MapServer_3
+def _cache_prefix(service_url):
+    return re.sub(r"[^A-Za-z0-9]+", "_", _layer_path(service_url)).strip("_")
+
+
+def _cache_path(key):
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    return CACHE_DIR / f"{_cache_prefix(key[0])}__{digest}.parquet"
+
+
+def _write_cache(path, df, spatial):
+    df = df.copy()
+    # geometry objects can't go to parquet, store them as esri json
+    if spatial and "SHAPE" in df.columns:
+        df["SHAPE"] = df["SHAPE"].apply(lambda geom: None if geom is None else geom.JSON)
+    try:
+        with replacing(path) as temporary:
+            df.to_parquet(temporary, index=False)
+    except (ValueError, TypeError, ImportError) as e:
+        # mixed type columns can't be written, keep the in-memory copy only
+        path.unlink(missing_ok=True)
+        warnings.warn(f"Could not cache {path.name}: {e}", stacklevel=2)
+
+
+def _read_cache(path, spatial):
+    df = pd.read_parquet(path)
+    if spatial and "SHAPE" in df.columns:
+        features.load()
+        df["SHAPE"] = df["SHAPE"].apply(
+            lambda s: None if s is None else geometry.Geometry(json.loads(s))
+        )
+        df.spatial.set_geometry("SHAPE")
+    return df
+
+
+# Return a cached query result or call fetch() and cache what it returns
+def cached_query(key, fetch):
+    ttl = CACHE_TTL.get(_layer_path(key[0]), CACHE_TTL_DEFAULT).total_seconds()
+    if CACHE_ONLY:
+        ttl = float("inf")
+    with _key_locks_guard:
+        lock = _key_locks.setdefault(key, threading.Lock())
+    with lock:
+        now = time.time()
+        memo = _memo_get(key)
+        if memo and now - memo[0] < ttl:
+            return memo[1].copy()
+        path = _cache_path(key)
+        if path.exists() and now - path.stat().st_mtime < ttl:
+            fetched_at = path.stat().st_mtime
+            df = _read_cache(path, spatial=key[3])
+        elif CACHE_ONLY:
+            raise RuntimeError(f"No cached result for {key[0]} where {key[1]}")
+        else:
+            fetched_at = now
+            df = fetch()
+            _write_cache(path, df, spatial=key[3])
+        _memo_put(key, fetched_at, df)
+        return df.copy()
+
+
+def _memo_get(key):
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+        return _memo.get(key)
+
+
+def _memo_put(key, fetched_at, df):
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    with _memo_lock:
+        _memo[key] = (fetched_at, df, size)
+        _memo.move_to_end(key)
+        total = sum(entry[2] for entry in _memo.values())
+        # the newest result is kept even if it is larger than the limit on its own
+        while total > MEMO_MAX_BYTES and len(_memo) > 1:
+            total -= _memo.popitem(last=False)[1][2]
+
+
+# Drop cached results and synced copies for one service url, or everything if no url is given
+def invalidate_cache(service_url=None):
+    if service_url is None:
+        with _memo_lock:
+            _memo.clear()
+        pattern = "*"
+    else:
+        service_url = service_url.rstrip("/")
+        with _memo_lock:
+            for key in [key for key in _memo if key[0] == service_url]:
+                del _memo[key]
+        pattern = f"{_cache_prefix(service_url)}__*"
+    for directory in [CACHE_DIR, SYNC_DIR]:
+        if directory.exists():
+            for path in directory.glob(pattern):
+                path.unlink()
+
+
+# REST query parameters and the matching FeatureLayer.query keyword
+_QUERY_KWARGS = {
+    "where": "where",
+    "outFields": "out_fields",
+    "resultOffset": "result_offset",
+    "resultRecordCount": "result_record_count",
+    "orderByFields": "order_by_fields",
+}
+# esri field types decoded straight to numpy dtypes, anything else is kept as strings
+_INTEGER_FIELDS = {
+    "esriFieldTypeOID",
+    "esriFieldTypeSmallInteger",
+    "esriFieldTypeInteger",
+    "esriFieldTypeBigInteger",
+}
+_FLOAT_FIELDS = {"esriFieldTypeDouble", "esriFieldTypeSingle"}
+# string columns with at most this share of distinct values can become categoricals
+CATEGORY_MAX_SHARE = 0.5
+# layer json (fields, maxRecordCount, capabilities), read once per service url
+_layer_info = {}
+
+
+# A query response that stopped at the layer's maxRecordCount (exceededTransferLimit)
+class TransferLimitExceeded(RuntimeError):
+    pass
+
+
+# Request json from the ArcGIS REST api, which reports errors in the body
+def _arcgis_request(url, params=None, post=False):
+    params = {**(params or {}), "f": "json"}
+    if post:
+        response = http_client.post(url, data=params)
+    else:
+        response = http_client.get(url, params=params)
+    response.raise_for_status()
+    result = response.json()
+    if "error" in result:
+        raise RuntimeError(f"{url}: {result['error'].get('message')}")
+    return result
+
+
+def _get_layer_info(service_url):
+    if service_url not in _layer_info:
+        _layer_info[service_url] = _arcgis_request(service_url)
+    return _layer_info[service_url]
+
+
+def _query_json(service_url, params):
+    return _arcgis_request(f"{service_url}/query", params, post=True)
+
+
+# Turn low-cardinality string columns into categoricals
+def _categorize(column):
+    if len(column) and len(pd.unique(column)) <= CATEGORY_MAX_SHARE * len(column):
+        return pd.Categorical(column)
+    return column
+
+
+# Build one typed column from the attribute values of a field
+def _decode_column(values, field_type, categorical=False):
+    if field_type == "esriFieldTypeDate":
+        # epoch milliseconds, nulls become NaT
+        return pd.to_datetime(np.array(values, dtype="float64"), unit="ms")
+    if field_type in _FLOAT_FIELDS:
+        return np.array(values, dtype="float64")
+    if field_type in _INTEGER_FIELDS:
+        if None in values:
+            return pd.array(values, dtype="Int64")
+        return np.array(values, dtype="int64")
+    column = np.array(values, dtype=object)
+    return _categorize(column) if categorical else column
+
+
+# Decode the json of a query response column by column instead of row by row.
+# Field types come from the response, falling back to the layer schema in field_types.
+def decode_features(result, field_types=None, categorical=False):
+    attributes = [feature["attributes"] for feature in result.get("features", [])]
+    fields = [(field["name"], field.get("type")) for field in result.get("fields") or []]
+    if not fields and attributes:
+        fields = [(name, (field_types or {}).get(name)) for name in attributes[0]]
+    return pd.DataFrame(
+        {
+            name: _decode_column([row.get(name) for row in attributes], field_type, categorical)
+            for name, field_type in fields
+        }
+    )
+
+
+# Fetch one query page. Attributes are decoded from the REST json,
+# geometry goes through the arcgis api to get a spatially enabled dataframe.
+def _fetch_page(service_url, params, return_geometry=False):
+    if return_geometry:
+        features.load()
+        kwargs = {_QUERY_KWARGS[name]: value for name, value in params.items()}
+        return cassette.recorded(
+            "arcgis_geometry",
+            [service_url, kwargs],
+            lambda: features.FeatureLayer(service_url).query(return_geometry=True, **kwargs).sdf,
+        )
+    fields = _get_layer_info(service_url).get("fields") or []
+    field_types = {field["name"]: field["type"] for field in fields}
+    result = _query_json(service_url, {**params, "returnGeometry": "false"})
+    # a resultOffset page is also flagged when there are rows after it, it is only cut short
+    # if it has fewer rows than it asked for
+    returned = len(result.get("features", []))
+    page_size = params.get("resultRecordCount")
+    if result.get("exceededTransferLimit") and (page_size is None or returned < page_size):
+        raise TransferLimitExceeded(
+            f"{service_url} where {params.get('where')} returned only its first {returned} rows"
+        )
+    return decode_features(result, field_types)
+
+
+# Query a feature layer in one request, or in pages if it has more than maxRecordCount rows
+def _query_layer(service_url, where="1=1", out_fields="*", return_geometry=False):
+    try:
+        return _fetch_page(service_url, dict(where=where, outFields=out_fields), return_geometry)
+    except TransferLimitExceeded:
+        return _query_layer_paged(service_url, where, out_fields, return_geometry)
+
+
+# Query a feature layer in pages of maxRecordCount rows, fetched in parallel
+def _query_layer_paged(
+    service_url, where="1=1", out_fields="*", return_geometry=False, max_workers=FETCH_WORKERS
+):
+    properties = _get_layer_info(service_url)
+    page_size = properties.get("maxRecordCount") or 1000
+    oid_field = properties.get("objectIdField") or "OBJECTID"
+    count = _query_json(service_url, dict(where=where, returnCountOnly="true"))["count"]
+    if count <= page_size:
+        # a page that is still cut short raises, the layer's real limit is below maxRecordCount
+        return _fetch_page(service_url, dict(where=where, outFields=out_fields), return_geometry)
+
+    advanced = properties.get("advancedQueryCapabilities") or {}
+    if advanced.get("supportsPagination"):
+        # page with resultOffset/resultRecordCount ordered on the object id
+        pages = [
+            dict(
+                where=where,
+                outFields=out_fields,
+                resultOffset=offset,
+                resultRecordCount=page_size,
+                orderByFields=oid_field,
+            )
+            for offset in range(0, count, page_size)
+        ]
+    else:
+        # fall back to object id ranges of page_size ids each
+        result = _query_json(service_url, dict(where=where, returnIdsOnly="true"))
+        object_ids = sorted(result["objectIds"])
+        chunks = [object_ids[i : i + page_size] for i in range(0, len(object_ids), page_size)]
+        pages = [
+            dict(
+                where=f"({where}) AND {oid_field} >= {ids[0]} AND {oid_field} <= {ids[-1]}",
+                outFields=out_fields,
+            )
+            for ids in chunks
+        ]
+
+    # pool.map keeps the pages in order
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(lambda page: _fetch_page(service_url, page, return_geometry), pages))
+    all_data = pd.concat(frames, ignore_index=True)
+    if return_geometry:
+        all_data.spatial.set_geometry("SHAPE")
+    return all_data
+
+
+# Edit dates come back as epoch milliseconds, or as datetimes in a spatial dataframe
+def _edit_timestamp(value):
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return pd.to_datetime(value, unit="ms")
+    return pd.Timestamp(value).tz_localize(None)
+
+
+# Keep a local copy of a layer and only download rows added or edited since the last sync.
+# The object id (and the edit date field, if the layer tracks edits) is the high-water mark.
+# Every SYNC_RECONCILE_EVERY the layer is downloaded in full so deleted rows drop out.
+def _sync_layer(
+    service_url, where="1=1", out_fields="*", return_geometry=False, max_workers=FETCH_WORKERS
+):
+    key = _cache_key(service_url, where, out_fields, return_geometry)
+    data_path = SYNC_DIR / _cache_path(key).name
+    state_path = data_path.with_suffix(".json")
+    properties = _get_layer_info(service_url)
+    oid_field = properties.get("objectIdField") or "OBJECTID"
+    edit_field = (properties.get("editFieldsInfo") or {}).get("editDateField")
+    fields = out_fields
+    added = []
+    if fields != "*":
+        # the high-water mark fields have to come back with the rows
+        requested = fields.split(",")
+        added = [f for f in dict.fromkeys([oid_field, edit_field]) if f and f not in requested]
+        fields = ",".join(dict.fromkeys(requested + added))
+
+    # a second process syncing the same layer waits and then only downloads what is newer
+    with file_lock(data_path):
+        state = json.loads(state_path.read_text()) if state_path.exists() else {}
+        now = time.time()
+        reconcile_due = now - state.get("reconciled_at", 0) > SYNC_RECONCILE_EVERY.total_seconds()
+        if reconcile_due or not data_path.exists():
+            all_data = _query_layer_paged(service_url, where, fields, return_geometry, max_workers)
+            state = {"reconciled_at": now}
+        else:
+            local = _read_cache(data_path, return_geometry)
+            newer = f"{oid_field} > {state['max_oid']}"
+            if state.get("max_edit"):
+                newer += f" OR {edit_field} > TIMESTAMP '{state['max_edit']}'"
+            delta = _query_layer_paged(
+                service_url, f"({where}) AND ({newer})", fields, return_geometry, max_workers
+            )
+            if len(delta):
+                # edited rows replace their old version
+                local = local[~local[oid_field].isin(delta[oid_field])]
+            all_data = pd.concat([local, delta], ignore_index=True)
+            all_data = all_data.sort_values(oid_field, ignore_index=True)
+            if return_geometry:
+                all_data.spatial.set_geometry("SHAPE")
+
+        state["max_oid"] = int(all_data[oid_field].max()) if len(all_data) else 0
+        if edit_field in all_data.columns and all_data[edit_field].notna().any():
+            max_edit = _edit_timestamp(all_data[edit_field].max())
+            state["max_edit"] = max_edit.strftime("%Y-%m-%d %H:%M:%S")
+        _write_cache(data_path, all_data, return_geometry)
+        with replacing(state_path) as temporary:
+            temporary.write_text(json.dumps(state))
+    # a plain query of the same fields has the same cache key, so it has to get the same columns
+    all_data = all_data.drop(columns=added)
+    if return_geometry:
+        all_data.spatial.set_geometry("SHAPE")
     return all_data
 
 
+# Cached query against the TRPA server
+def _get_layer(
+    service_url,
+    where="1=1",
+    out_fields="*",
+    return_geometry=False,
+    paginate=False,
+    max_workers=FETCH_WORKERS,
+    sync=False,
+):
+    key = _cache_key(service_url, where, out_fields, return_geometry)
+    if sync:
+        return cached_query(key, lambda: _sync_layer(*key, max_workers=max_workers))
+    if paginate:
+        return cached_query(key, lambda: _query_layer_paged(*key, max_workers=max_workers))
+    return cached_query(key, lambda: _query_layer(*key))
+
+
+# Gets data with query from the TRPA server
+def get_fs_data_query(service_url, query_params, paginate=False, max_workers=FETCH_WORKERS):
+    return _get_layer(service_url, where=query_params, paginate=paginate, max_workers=max_workers)
+
+
 # Gets data from the TRPA server
-def get_fs_data(service_url):
-    feature_layer = FeatureLayer(service_url)
-    query_result = feature_layer.query()
-    # Convert the query result to a list of dictionaries
-    feature_list = query_result.features
-    # Create a pandas DataFrame from the list of dictionaries
-    all_data = pd.DataFrame([feature.attributes for feature in feature_list])
-    # return data frame
+# attributes only, no geometry is requested or built unless return_geometry=True,
+# ask for the Shape.STLength()/Shape.STArea() fields when only the size of features is needed
+# where and out_fields are applied on the server so only the rows and columns used come back
+# paginate=True pulls large layers in parallel pages instead of one capped request
+# sync=True keeps a local copy of growing layers and only downloads new or edited rows
+# categorical=True stores low-cardinality string columns as categoricals
+# date fields come back as UTC datetime64 columns
+def get_fs_data(
+    service_url,
+    where="1=1",
+    out_fields="*",
+    return_geometry=False,
+    paginate=False,
+    max_workers=FETCH_WORKERS,
+    sync=False,
+    categorical=False,
+):
+    all_data = _get_layer(
+        service_url,
+        where=where,
+        out_fields=out_fields,
+        return_geometry=return_geometry,
+        paginate=paginate,
+        max_workers=max_workers,
+        sync=sync,
+    )
+    if categorical:
+        for column in all_data.select_dtypes(include=["object", "string"]).columns:
+            all_data[column] = _categorize(all_data[column].to_numpy())
     return all_data
 
 
 # Gets spatially enabled dataframe from TRPA server
-def get_fs_data_spatial(service_url):
-    feature_layer = FeatureLayer(service_url)
-    query_result = feature_layer.query().sdf
-    return query_result
+def get_fs_data_spatial(
+    service_url, where="1=1", out_fields="*", paginate=False, max_workers=FETCH_WORKERS
+):
+    return _get_layer(
+        service_url,
+        where=where,
+        out_fields=out_fields,
+        return_geometry=True,
+        paginate=paginate,
+        max_workers=max_workers,
+    )
 
 
 # Gets spatially enabled dataframe with query
-def get_fs_data_spatial_query(service_url, query_params):
-    feature_layer = FeatureLayer(service_url)
-    query_result = feature_layer.query(query_params).sdf
-    return query_result
+def get_fs_data_spatial_query(service_url, query_params, paginate=False, max_workers=FETCH_WORKERS):
+    return _get_layer(
+        service_url,
+        where=query_params,
+        return_geometry=True,
+        paginate=paginate,
+        max_workers=max_workers,
+    )
+
+
+# Run an outStatistics query, paging when the server supports it on aggregated queries
+def _query_stats(service_url, where, group_by, statistics):
+    properties = _get_layer_info(service_url)
+    page_size = properties.get("maxRecordCount") or 1000
+    advanced = properties.get("advancedQueryCapabilities") or {}
+    pageable = bool(group_by) and advanced.get("supportsPaginationOnAggregatedQueries")
+    out_statistics = [
+        dict(statisticType=stat, onStatisticField=field, outStatisticFieldName=field)
+        for field, stat in statistics.items()
+    ]
+    params = dict(where=where, outStatistics=json.dumps(out_statistics))
+    if group_by:
+        params["groupByFieldsForStatistics"] = ",".join(group_by)
+    frames = []
+    offset = 0
+    while True:
+        page = dict(params)
+        if pageable:
+            page.update(
+                resultOffset=offset,
+                resultRecordCount=page_size,
+                orderByFields=params["groupByFieldsForStatistics"],
+            )
+        try:
+            frames.append(_fetch_page(service_url, page))
+        except TransferLimitExceeded as e:
+            # the groups past maxRecordCount would be silently missing from the summary
+            raise TransferLimitExceeded(
+                f"{e}, group on fewer distinct values or fetch the rows and summarize them"
+            ) from None
+        if not pageable or len(frames[-1]) < page_size:
+            break
+        offset += page_size
+    all_data = pd.concat(frames, ignore_index=True)
+    # some databases return upper case field names
+    names = {name.lower(): name for name in list(group_by or []) + list(statistics)}
+    return all_data.rename(columns=lambda column: names.get(column.lower(), column))
+
+
+# Gets summary rows computed by the TRPA server instead of the raw features
+# statistics maps a field to an ArcGIS statistic type, e.g. {"Acres": "sum"}
+# rows where a group by field is null come back as their own group
+def get_fs_data_stats(service_url, statistics, group_by=None, where="1=1"):
+    summary = ",".join(f"{stat}({field})" for field, stat in statistics.items())
+    group_by_fields = ",".join(group_by or [])
+    key = _cache_key(service_url, where, f"stats:{summary} by {group_by_fields}")
+    return cached_query(key, lambda: _query_stats(service_url, key[1], group_by, statistics))
 
 
 # Function to convert Unix timestamp to UTC datetime
@@ -60,7 +643,708 @@ def convert_to_utc(timestamp):
     return datetime.utcfromtimestamp(timestamp // 1000).replace(tzinfo=pytz.utc)
 
 
+# Look shared by every chart, registered with plotly as the "dashboard" template.
+# It is written into every html file, so it holds only the parts of plotly_white that the
+# bar and line charts here use (about 1 kB instead of 7 kB) and the settings they all share.
+TEMPLATE = "dashboard"
+_AXIS = dict(
+    automargin=True,
+    gridcolor="#EBF0F8",
+    linecolor="#EBF0F8",
+    ticks="",
+    title=dict(standoff=15),
+    zerolinecolor="#EBF0F8",
+    zerolinewidth=2,
+)
+TEMPLATE_LAYOUT = dict(
+    annotationdefaults=dict(arrowcolor="#2a3f5f", arrowhead=0, arrowwidth=1),
+    # numbers in string columns (years, ids) stay categories
+    autotypenumbers="strict",
+    colorway=[
+        "#636efa",
+        "#EF553B",
+        "#00cc96",
+        "#ab63fa",
+        "#FFA15A",
+        "#19d3f3",
+        "#FF6692",
+        "#B6E880",
+        "#FF97FF",
+        "#FECB52",
+    ],
+    dragmode=False,
+    font=dict(color="#2a3f5f"),
+    hoverlabel=dict(align="left"),
+    hovermode="closest",
+    paper_bgcolor="white",
+    plot_bgcolor="white",
+    shapedefaults=dict(line=dict(color="#2a3f5f")),
+    title=dict(x=0.05),
+    xaxis=_AXIS,
+    yaxis=_AXIS,
+)
+TEMPLATE_DATA = dict(bar=[dict(marker=dict(line=dict(color="white", width=0.5)))])
+# trendline, stackedbar and groupedbar_percent build their traces with graph_objects
+# instead of plotly express when the chart is one _fast_figure can reproduce
+FAST_BUILDERS = True
+# horizontal gap between facet columns, as a share of the figure width (px's default)
+FACET_SPACING = 0.02
+# px.line draws with webgl above this many rows
+WEBGL_ROWS = 1000
+
+
+def dashboard_template():
+    pio = importlib.import_module("plotly.io")
+    if TEMPLATE not in pio.templates:
+        pio.templates[TEMPLATE] = go.layout.Template(layout=TEMPLATE_LAYOUT, data=TEMPLATE_DATA)
+    return TEMPLATE
+
+
+# Set the keys of a layout or trace dict that have a value and drop the ones set to None,
+# the same as plotly's update() does
+def _set(target, **values):
+    for key, value in values.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = value
+    return target
+
+
+# Whether _fast_figure draws the same chart plotly express would for these arguments.
+# Anything else (horizontal bars, facet rows, hover_data, continuous colors) goes through px.
+def _fast_path(df, x, y, color=None, facet=None, kind="bar", **unsupported):
+    if not FAST_BUILDERS or any(value is not None for value in unsupported.values()):
+        return False
+    columns = [c for c in [x, y, color, facet] if c is not None]
+    if not all(isinstance(c, str) and c in df.columns for c in columns):
+        return False
+    if color is not None and color == facet:
+        return False
+    if kind == "bar" and color is not None and pd.api.types.is_numeric_dtype(df[color]):
+        return False
+    # px makes the chart horizontal when x is numeric and y isn't
+    return pd.api.types.is_numeric_dtype(df[y])
+
+
+# Groups of df by color and facet in the order px draws them: category_orders first, then
+# order of appearance, sorted by the order columns in the order they were given.
+# Returns the orders and [(color value, facet value, rows)].
+def _px_groups(df, color, facet, orders):
+    orders = {column: list(values) for column, values in (orders or {}).items()}
+    columns = [c for c in [color, facet] if c is not None]
+    for column in columns:
+        uniques = list(df[column].unique())
+        orders[column] = list(dict.fromkeys(orders.get(column, []) + uniques))
+    grouper = [column for column in orders if column in columns]
+    if all(df[column].nunique(dropna=False) == 1 for column in columns):
+        groups = [(tuple(df[column].iloc[0] for column in grouper), df)]
+    else:
+        groups = sorted(
+            df.groupby(grouper, sort=False, dropna=True),
+            key=lambda group: [
+                orders[column].index(value) if value in orders[column] else -1
+                for column, value in zip(grouper, group[0])
+            ],
+        )
+    groups = [
+        (
+            values[grouper.index(color)] if color is not None else None,
+            values[grouper.index(facet)] if facet is not None else None,
+            rows,
+        )
+        for values, rows in groups
+    ]
+    return orders, groups
+
+
+# The traces and layout px.line (kind="line") or px.bar (kind="bar") makes, as plain dicts
+# so the builders can set their options before the figure is validated once.
+def _fast_figure(
+    df,
+    kind,
+    x,
+    y,
+    color=None,
+    color_sequence=None,
+    orders=None,
+    facet=None,
+    custom_data=None,
+    markers=False,
+    barmode=None,
+):
+    if color_sequence is None:
+        pio = importlib.import_module("plotly.io")
+        color_sequence = pio.templates[pio.templates.default].layout.colorway
+    orders, groups = _px_groups(df, color, facet, orders)
+    colors = {
+        value: color_sequence[i % len(color_sequence)]
+        for i, value in enumerate(orders.get(color, [None]))
+    }
+    columns = orders[facet] if facet is not None else [None]
+    webgl = kind == "line" and len(df) > WEBGL_ROWS
+
+    data = []
+    names = set()
+    for color_value, facet_value, rows in groups:
+        name = str(color_value) if color is not None else ""
+        column = columns.index(facet_value) + 1
+        trace = dict(
+            type="bar" if kind == "bar" else "scattergl" if webgl else "scatter",
+            name=name,
+            legendgroup=name,
+            showlegend=name != "" and name not in names,
+            x=rows[x].to_numpy(),
+            y=rows[y].to_numpy(),
+            xaxis=f"x{column}" if column > 1 else "x",
+            yaxis=f"y{column}" if column > 1 else "y",
+        )
+        names.add(name)
+        if not webgl:
+            trace["orientation"] = "v"
+        if custom_data:
+            trace["customdata"] = rows[list(custom_data)].to_numpy()
+        if kind == "bar":
+            trace["marker"] = dict(color=colors[color_value], pattern=dict(shape=""))
+            trace["textposition"] = "auto"
+            if barmode == "group":
+                trace.update(alignmentgroup=True, offsetgroup=name)
+        else:
+            trace["mode"] = "lines+markers" if markers else "lines"
+            trace["line"] = dict(color=colors[color_value], dash="solid")
+            trace["marker"] = dict(symbol="circle")
+        data.append(trace)
+
+    layout = dict(legend=dict(tracegroupgap=0), margin=dict(t=60))
+    if barmode:
+        layout["barmode"] = barmode
+    width = (1 - FACET_SPACING * (len(columns) - 1)) / len(columns)
+    annotations = []
+    for i, facet_value in enumerate(columns):
+        suffix = str(i + 1) if i else ""
+        start = i * (width + FACET_SPACING)
+        xaxis = dict(anchor=f"y{suffix}", domain=[start, start + width], title=dict(text=x))
+        yaxis = dict(anchor=f"x{suffix}", domain=[0.0, 1.0])
+        if i:
+            xaxis["matches"] = "x"
+            yaxis.update(matches="y", showticklabels=False)
+        else:
+            yaxis["title"] = dict(text=y)
+        if x in orders:
+            xaxis.update(categoryorder="array", categoryarray=orders[x])
+        if y in orders and not i:
+            yaxis.update(categoryorder="array", categoryarray=orders[y][::-1])
+        layout[f"xaxis{suffix}"] = xaxis
+        layout[f"yaxis{suffix}"] = yaxis
+        if facet is not None:
+            annotations.append(
+                dict(
+                    text=f"{facet}={facet_value}",
+                    showarrow=False,
+                    x=start + width / 2,
+                    xanchor="center",
+                    xref="paper",
+                    y=1.0,
+                    yanchor="bottom",
+                    yref="paper",
+                )
+            )
+    if annotations:
+        layout["annotations"] = annotations
+    return data, layout
+
+
+def _axes(layout, letter):
+    return [value for key, value in layout.items() if re.fullmatch(f"{letter}axis\\d*", key)]
+
+
+# update_layout(xaxis=dict(title="...")) sets the title text, None removes the title
+def _title(title):
+    return dict(text=title) if isinstance(title, str) else title
+
+
+# The layout stackedbar and groupedbar_percent give a _fast_figure bar chart
+def _bar_layout(data, layout, y_title, x_title, hovermode, format, hovertemplate):
+    for trace in data:
+        _set(trace, hovertemplate=hovertemplate)
+    for annotation in layout.get("annotations", []):
+        annotation["text"] = annotation["text"].split("=")[-1]
+    _set(layout["yaxis"], tickformat=format, hoverformat=format, title=_title(y_title))
+    _set(layout["xaxis"], title=_title(x_title))
+    _set(layout, hovermode=hovermode, template=dashboard_template())
+    yaxes = _axes(layout, "y")
+    for axis in yaxes:
+        _set(axis, showticklabels=True, tickformat=format)
+    # facets 2 and 3 share the first facet's y axis labels
+    for axis in yaxes[1:3]:
+        _set(axis, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None)
+
+
+# Line traces longer than this are cut down to it by downsample
+MAX_POINTS = 2000
+
+# Runs in the chart page when downsample(zoom_detail=True): zooming in fetches the full
+# resolution traces written next to the html and redraws the zoomed range from them,
+# cut down to the same point budget, autoscale puts the downsampled traces back
+_ZOOM_SCRIPT = """
+(function () {
+  var gd = document.getElementById("{plot_id}");
+  var source = "%(source)s", budget = %(budget)d, full = null, overview = null;
+  function num(v) { return typeof v === "string" ? Date.parse(v.replace(" ", "T")) : v; }
+  function lttb(xs, ys, n) {
+    if (xs.length <= n) return xs.map(function (_, i) { return i; });
+    var out = [0], a = 0, size = (xs.length - 2) / (n - 2);
+    for (var i = 0; i < n - 2; i++) {
+      var start = Math.floor(i * size) + 1, end = Math.floor((i + 1) * size) + 1;
+      var nextEnd = Math.min(Math.floor((i + 2) * size) + 1, xs.length), ax = 0, ay = 0;
+      for (var j = end; j < nextEnd; j++) { ax += xs[j]; ay += ys[j]; }
+      ax /= (nextEnd - end) || 1; ay /= (nextEnd - end) || 1;
+      var best = start, max = -1;
+      for (var j = start; j < end; j++) {
+        var area = Math.abs((xs[a] - ax) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (ay - ys[a]));
+        if (area > max) { max = area; best = j; }
+      }
+      out.push(a = best);
+    }
+    out.push(xs.length - 1);
+    return out;
+  }
+  gd.on("plotly_relayout", function (e) {
+    if (e["xaxis.autorange"] && overview) { Plotly.restyle(gd, overview.update, overview.traces); return; }
+    if (e["xaxis.range[0]"] === undefined) return;
+    var x0 = num(e["xaxis.range[0]"]), x1 = num(e["xaxis.range[1]"]);
+    var data = full ? Promise.resolve(full) : fetch(source).then(function (r) { return r.json(); });
+    data.then(function (d) {
+      full = d;
+      var update = {x: [], y: [], customdata: []}, traces = [];
+      if (!overview) {
+        overview = {update: {x: [], y: [], customdata: []}, traces: []};
+        d.traces.forEach(function (t) {
+          overview.update.x.push(gd.data[t.index].x); overview.update.y.push(gd.data[t.index].y);
+          overview.update.customdata.push(gd.data[t.index].customdata); overview.traces.push(t.index);
+        });
+      }
+      d.traces.forEach(function (t) {
+        var keep = [];
+        t.x.forEach(function (v, i) { var n = num(v); if (n >= x0 && n <= x1) keep.push(i); });
+        var pick = lttb(keep.map(function (i) { return num(t.x[i]); }),
+                        keep.map(function (i) { return t.y[i] === null ? 0 : t.y[i]; }), budget)
+          .map(function (i) { return keep[i]; });
+        update.x.push(pick.map(function (i) { return t.x[i]; }));
+        update.y.push(pick.map(function (i) { return t.y[i]; }));
+        update.customdata.push(t.customdata ? pick.map(function (i) { return t.customdata[i]; }) : null);
+        traces.push(t.index);
+      });
+      Plotly.restyle(gd, update, traces);
+    });
+  });
+})();
+"""
+
+
+# Indices of n_out points of (x, y) picked with Largest-Triangle-Three-Buckets: the first
+# and last points and, from each of n_out - 2 buckets in between, the point making the largest
+# triangle with the point picked before it and the average of the next bucket.
+# Peaks and troughs survive where striding or averaging would flatten them.
+def lttb(x, y, n_out):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    edges[-1] = n - 1
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        if i + 2 < len(edges):
+            next_x, next_y = x[end : edges[i + 2]], y[end : edges[i + 2]]
+            next_x = next_x.mean() if len(next_x) else x[end]
+            next_y = np.nanmean(next_y) if np.isfinite(next_y).any() else y[a]
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        # buckets of missing values (the start of a rolling average) keep their first point
+        a = start + (int(np.nanargmax(area)) if np.isfinite(area).any() else 0)
+        indices[i + 1] = a
+    return indices
+
+
+# x values as numbers for lttb: dates as nanoseconds, anything else that isn't a number by
+# position
+def _numeric_x(values):
+    values = np.asarray(values)
+    if values.dtype.kind in "iuf":
+        return values.astype(float)
+    try:
+        return pd.to_datetime(values).to_numpy().astype("datetime64[ns]").astype("int64")
+    except (TypeError, ValueError):
+        return np.arange(len(values), dtype=float)
+
+
+# Trace values for json.dumps(default=str), missing numbers become null
+def _json_values(values):
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        return np.datetime_as_string(values, unit="s").tolist()
+    if values.dtype.kind == "f":
+        return [None if np.isnan(v) else v for v in values.tolist()]
+    return values.tolist()
+
+
+# Cut every line trace of fig with more than max_points (default MAX_POINTS) points down to
+# max_points with lttb, customdata and text follow the kept points. Stacked and filled traces
+# are left alone, their points have to line up.
+# With zoom_detail the full traces are written to <path_html>.full.json and the page swaps them
+# in when it is zoomed in, the post_script returned goes to write_html for that. The chart
+# needs dragmode="zoom", the dashboard template turns zooming off.
+def downsample(fig, max_points=None, zoom_detail=False, path_html=None):
+    max_points = max_points or MAX_POINTS
+    full = []
+    for index, trace in enumerate(fig.data):
+        if trace.type not in ("scatter", "scattergl") or trace.x is None or trace.y is None:
+            continue
+        stacked = trace.type == "scatter" and trace.stackgroup
+        if stacked or trace.fill not in (None, "none") or len(trace.y) <= max_points:
+            continue
+        if trace.mode is not None and "lines" not in trace.mode:
+            continue
+        x, y = np.asarray(trace.x), np.asarray(trace.y, dtype=float)
+        if zoom_detail:
+            full.append(dict(index=index, x=_json_values(x), y=_json_values(y)))
+            if trace.customdata is not None:
+                full[-1]["customdata"] = np.asarray(trace.customdata).tolist()
+        keep = lttb(_numeric_x(x), y, max_points)
+        update = dict(x=x[keep], y=y[keep])
+        for name in ["customdata", "text", "hovertext"]:
+            values = getattr(trace, name)
+            if values is not None and not isinstance(values, str) and len(values) == len(y):
+                update[name] = np.asarray(values)[keep]
+        trace.update(update)
+    if not full:
+        return None
+    source = Path(path_html).with_suffix(".full.json")
+    source.write_text(json.dumps(dict(traces=full), default=str))
+    return _ZOOM_SCRIPT % dict(source=source.name, budget=max_points)
+
+
+# Trace values are rounded to the decimals their hovertemplate (or texttemplate) shows,
+# e.g. %{y:,.0f} or %{customdata[1]:.1%}, but never below SIGNIFICANT_DIGITS of the largest
+# value so lines and bars are drawn where they were. Values shown without a format keep full
+# precision unless the chart's PRECISION policy says otherwise.
+SIGNIFICANT_DIGITS = 3
+# per chart (html file name) decimals for a column, a column is one the builder drew from
+# (its x, y or custom_data) or a trace attribute: "x", "y", "customdata[0]".
+# None keeps full precision.
+PRECISION = {
+    # meteostat reports tenths of a degree Celsius
+    "1.2.a_TahoeTemp.html": {"y": 1},
+}
+_TEMPLATE_VALUE = re.compile(r"%\{(x|y|z|customdata(?:\[\d+\])?)(?::([^}]*))?\}")
+
+
+# Decimals a d3 number format shows, None for formats that count significant digits
+def _format_decimals(spec):
+    match = re.search(r"(?:\.(\d+))?~?([a-z%]?)$", spec)
+    precision, kind = match.groups()
+    if kind == "d":
+        return 0
+    if kind in ("f", "%"):
+        decimals = int(precision) if precision is not None else 6
+        return decimals + 2 if kind == "%" else decimals
+    return None
+
+
+# {attribute: decimals} of the values the trace's templates show
+def _displayed_decimals(trace, layout):
+    decimals = {}
+    unformatted = set()
+    templates = [getattr(trace, "hovertemplate", None), getattr(trace, "texttemplate", None)]
+    for template in templates:
+        if not isinstance(template, str):
+            continue
+        for attribute, spec in _TEMPLATE_VALUE.findall(template):
+            if spec and spec.startswith("|"):
+                continue
+            if not spec:
+                # %{y} is shown with the axis' hoverformat
+                if attribute in ("x", "y"):
+                    axis = getattr(trace, f"{attribute}axis", None) or attribute
+                    spec = layout[f"{attribute}axis{axis[1:]}"].hoverformat
+            places = _format_decimals(spec) if spec else None
+            if places is None:
+                unformatted.add(attribute)
+            else:
+                decimals[attribute] = max(places, decimals.get(attribute, 0))
+    return {k: v for k, v in decimals.items() if k not in unformatted}
+
+
+def _round_values(values, decimals, floor):
+    try:
+        numbers = np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    if floor:
+        largest = np.nanmax(np.abs(numbers)) if np.isfinite(numbers).any() else 0
+        if largest > 0:
+            decimals = max(decimals, SIGNIFICANT_DIGITS - 1 - int(np.floor(np.log10(largest))))
+    return np.round(numbers, decimals)
+
+
+# Round the float arrays of every trace in fig before it is written, see PRECISION.
+# columns maps trace attributes to the dataframe columns the builder drew them from, e.g.
+# {"x": "Year", "y": "Value", "customdata": ["Category", "Total"]}, so the chart's policy
+# can name columns.
+def round_traces(fig, path_html=None, columns=None):
+    policy = PRECISION.get(Path(path_html).name, {}) if path_html else {}
+    names = {}
+    for attribute, column in (columns or {}).items():
+        if isinstance(column, str):
+            names[attribute] = column
+        elif attribute == "customdata" and column is not None:
+            names.update({f"customdata[{i}]": name for i, name in enumerate(column)})
+    for trace in fig.data:
+        shown = _displayed_decimals(trace, fig.layout)
+        for attribute in ["x", "y", "z", "customdata"]:
+            values = getattr(trace, attribute, None)
+            if values is None or isinstance(values, str):
+                continue
+            values = np.asarray(values)
+            if values.dtype.kind in "iubMmSU":
+                continue
+            keys = (
+                [f"customdata[{i}]" for i in range(values.shape[1])]
+                if values.ndim == 2
+                else [attribute]
+            )
+            columns = [values[:, i] for i in range(len(keys))] if values.ndim == 2 else [values]
+            changed = False
+            for i, key in enumerate(keys):
+                name = names.get(key)
+                if name in policy or key in policy:
+                    decimals, floor = policy[name] if name in policy else policy[key], False
+                else:
+                    decimals, floor = shown.get(key), True
+                rounded = (
+                    _round_values(columns[i], decimals, floor) if decimals is not None else None
+                )
+                if rounded is not None:
+                    columns[i], changed = rounded, True
+            if changed:
+                trace[attribute] = np.column_stack(columns) if values.ndim == 2 else columns[0]
+
+
+# Write trace arrays as base64 typed arrays ({"dtype": "u2", "bdata": ...}) instead of json
+# number lists, which plotly.js 2.28 and later decode straight into typed arrays. Set
+# DASHBOARD_BINARY_ARRAYS=1 (or run indicators --binary-arrays) to turn it on, the render
+# processes and the scheduler's tasks read it from the environment.
+BINARY_ARRAYS = os.environ.get("DASHBOARD_BINARY_ARRAYS") == "1"
+# first plotly.js that reads typed arrays
+BINARY_PLOTLYJS = (2, 28)
+# smallest first
+_INT_DTYPES = ["i1", "u1", "i2", "u2", "i4", "u4"]
+
+
+# Decimals the values are written with, None if more than float64 keeps
+def _decimals(values):
+    for decimals in range(16):
+        if np.array_equal(np.round(values, decimals), values):
+            return decimals
+    return None
+
+
+def _typed_spec(values, dtype):
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    spec = dict(dtype=dtype, bdata=base64.b64encode(values.tobytes()).decode("ascii"))
+    if values.ndim > 1:
+        spec["shape"] = ",".join(str(n) for n in values.shape)
+    return spec
+
+
+# Typed array spec of the narrowest dtype that keeps every value, or None for values that
+# aren't numbers or dates. Dates become milliseconds since 1970, which is how plotly.js reads
+# numbers on a date axis. float32 is only used for axis values (single_ok) that read back the
+# same at the decimals they are written with, hover shows them with the axis format.
+def typed_array(values, single_ok=False):
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        milliseconds = values.astype("datetime64[ms]")
+        if not np.array_equal(milliseconds, values, equal_nan=True):
+            return None
+        numbers = milliseconds.astype("int64").astype("f8")
+        numbers[np.isnat(milliseconds)] = np.nan
+        return _typed_spec(numbers, "f8")
+    if values.dtype.kind not in "iuf" or values.size == 0:
+        return None
+    finite = values[np.isfinite(values)] if values.dtype.kind == "f" else values
+    if len(finite) == values.size and np.array_equal(np.round(finite), finite):
+        low, high = (finite.min(), finite.max()) if finite.size else (0, 0)
+        for dtype in _INT_DTYPES:
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                return _typed_spec(values, dtype)
+    if values.dtype.kind in "iu" and np.abs(values).max() >= 2**53:
+        return None
+    if single_ok and finite.size:
+        decimals = _decimals(finite)
+        single = finite.astype("f4").astype("f8")
+        if decimals is not None and np.array_equal(np.round(single, decimals), finite):
+            return _typed_spec(values, "f4")
+    return _typed_spec(values, "f8")
+
+
+# fig as a dict with its x, y, z and numeric customdata arrays as typed arrays.
+# Axes that get dates as numbers are set to type date, which plotly guessed from the strings.
+def binary_figure(fig):
+    figure = fig.to_plotly_json()
+    layout = figure.setdefault("layout", {})
+    for trace, data in zip(fig.data, figure["data"]):
+        for attribute in ["x", "y", "z", "customdata"]:
+            values = getattr(trace, attribute, None)
+            if values is None or isinstance(values, str):
+                continue
+            # strings and mixed columns, including dates with a timezone, stay json
+            values = np.asarray(values)
+            axis = None
+            if values.dtype.kind == "M":
+                if attribute not in ("x", "y"):
+                    continue
+                name = getattr(trace, f"{attribute}axis", None) or attribute
+                axis = layout.setdefault(f"{attribute}axis{name[1:]}", {})
+                if axis.get("type", "date") != "date":
+                    continue
+            spec = typed_array(values, single_ok=attribute != "customdata")
+            if spec is None:
+                continue
+            data[attribute] = spec
+            if axis is not None:
+                axis["type"] = "date"
+    return figure
+
+
+def _plotlyjs_version(file, include_plotlyjs):
+    bundle = Path(file).parent / "plotly.min.js"
+    if include_plotlyjs == "directory" and bundle.exists():
+        with open(bundle, encoding="utf-8") as f:
+            version = re.search(r"plotly\.js v(\d+)\.(\d+)", f.read(200))
+        if version is None:
+            return None
+        return tuple(int(n) for n in version.groups())
+    plotly_offline = importlib.import_module("plotly.offline")
+    return tuple(int(n) for n in plotly_offline.get_plotlyjs_version().split(".")[:2])
+
+
+# Trace arrays written to one data file per plot next to the html instead of into every
+# page, the pages fetch it and fill their charts in when they load. The charts a plot function
+# writes (the _v1/_v2 variants) share the file, so the browser downloads their data once.
+# Set DASHBOARD_SHARED_DATA=1 (or run indicators --shared-data) to turn it on.
+SHARED_DATA = os.environ.get("DASHBOARD_SHARED_DATA") == "1"
+# folder next to the html files the data files go in
+SHARED_DATA_DIR = "data"
+_SHARED_ATTRIBUTES = ["x", "y", "z", "customdata", "text", "hovertext"]
+# pages waiting for their plot's data file, per thread as plots render on a thread pool
+_shared = threading.local()
+
+# Runs in the chart page: fetches the plot's data file and redraws the chart with the arrays
+# refs lists as [trace, attribute, key in the data file]
+_BIND_SCRIPT = """
+(function () {
+  var gd = document.getElementById("{plot_id}");
+  var source = "%(source)s", refs = %(refs)s;
+  fetch(source).then(function (r) { return r.json(); }).then(function (shared) {
+    var data = gd.data.map(function (t) { return Object.assign({}, t); });
+    refs.forEach(function (ref) { data[ref[0]][ref[1]] = shared[ref[2]]; });
+    Plotly.react(gd, data, gd.layout);
+  });
+})();
+"""
+
+
+# Collect the pages written by the plot name and write them with one data file on the way out
+# (html/data/<name>.<hash>.json), without it every page gets a data file of its own
+@contextmanager
+def shared_data(name):
+    _shared.pages = []
+    try:
+        yield
+        if _shared.pages:
+            _write_shared(name, _shared.pages)
+    finally:
+        del _shared.pages
+
+
+def _write_shared(name, pages):
+    pio = importlib.import_module("plotly.io")
+    arrays = {}
+    page_refs = []
+    for figure, file, kwargs in pages:
+        refs = []
+        for index, trace in enumerate(figure["data"]):
+            for attribute in _SHARED_ATTRIBUTES:
+                values = trace.get(attribute)
+                if not isinstance(values, (list, dict)):
+                    continue
+                text = json.dumps(values, separators=(",", ":"))
+                key = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+                arrays[key] = values
+                trace[attribute] = []
+                refs.append([index, attribute, key])
+        page_refs.append(refs)
+    content = json.dumps(arrays, separators=(",", ":"))
+    directory = Path(pages[0][1]).parent / SHARED_DATA_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{name}.{hashlib.sha1(content.encode('utf-8')).hexdigest()[:10]}.json"
+    # the file name changes with its content so browsers can keep it, drop the old ones
+    for old in directory.glob(f"{name}.*.json"):
+        if old != path:
+            old.unlink()
+    path.write_text(content)
+    for (figure, file, kwargs), refs in zip(pages, page_refs):
+        source = Path(os.path.relpath(path, Path(file).parent)).as_posix()
+        scripts = kwargs.pop("post_script", None) or []
+        scripts = [scripts] if isinstance(scripts, str) else list(scripts)
+        bind = _BIND_SCRIPT % dict(source=source, refs=json.dumps(refs))
+        pio.write_html(figure, file=file, validate=False, post_script=[bind] + scripts, **kwargs)
+
+
+# fig.write_html, with the trace arrays as typed arrays if BINARY_ARRAYS is on and in a shared
+# data file if SHARED_DATA is on
+def write_html(fig, file, include_plotlyjs=True, **kwargs):
+    if not BINARY_ARRAYS and not SHARED_DATA:
+        fig.write_html(file=file, include_plotlyjs=include_plotlyjs, **kwargs)
+        return
+    pio = importlib.import_module("plotly.io")
+    if BINARY_ARRAYS:
+        version = _plotlyjs_version(file, include_plotlyjs)
+        if version is not None and version < BINARY_PLOTLYJS:
+            raise RuntimeError(
+                f"plotly.js {version[0]}.{version[1]} can't read typed arrays, "
+                + (
+                    f"{Path(file).parent / 'plotly.min.js'} needs to be plotly.js 2.28 or later"
+                    if include_plotlyjs == "directory"
+                    else "update plotly to 5.19 or later"
+                )
+            )
+        figure = binary_figure(fig)
+    else:
+        figure = fig.to_plotly_json()
+    kwargs["include_plotlyjs"] = include_plotlyjs
+    if not SHARED_DATA:
+        pio.write_html(figure, file=file, validate=False, **kwargs)
+        return
+    # plain json values, the arrays are compared and written as they are on the page
+    page = (json.loads(pio.to_json(figure, validate=False)), file, kwargs)
+    if getattr(_shared, "pages", None) is not None:
+        _shared.pages.append(page)
+    else:
+        _write_shared(Path(file).stem, [page])
+
+
 # Trendline
+@profiled
 def trendline(
     df,
     path_html,
@@ -83,45 +1367,70 @@ def trendline(
     hovermode,
     custom_data,
     additional_formatting=None,
+    max_points=None,
+    zoom_detail=False,
 ):
     df = df.sort_values(by=sort)
     config = {"displayModeBar": False}
-    fig = px.line(
-        df,
-        x=x,
-        y=y,
-        color=color,
-        color_discrete_sequence=color_sequence,
-        category_orders=orders,
-        markers=markers,
-        hover_data=hover_data,
-        custom_data=custom_data,
-    )
-    fig.update_layout(
-        yaxis=dict(title=y_title),
-        xaxis=dict(title=x_title, showgrid=False),
-        hovermode=hovermode,
-        template="plotly_white",
-        dragmode=False,
-        legend_title=None,
-    )
-    fig.update_traces(hovertemplate=hovertemplate)
-    fig.update_yaxes(tickformat=format)
-    fig.update_xaxes(
-        tickvals=tickvals,
-        ticktext=ticktext,
-        tickangle=tickangle,
-    )
+    if _fast_path(df, x, y, color, kind="line", hover_data=hover_data):
+        data, layout = _fast_figure(
+            df, "line", x, y, color, color_sequence, orders, None, custom_data, markers
+        )
+        for trace in data:
+            _set(trace, hovertemplate=hovertemplate)
+        _set(layout["yaxis"], title=_title(y_title))
+        _set(layout["xaxis"], title=_title(x_title), showgrid=False)
+        _set(layout, hovermode=hovermode, template=dashboard_template())
+        for axis in _axes(layout, "y"):
+            _set(axis, tickformat=format)
+        for axis in _axes(layout, "x"):
+            _set(axis, tickvals=tickvals, ticktext=ticktext, tickangle=tickangle)
+        fig = go.Figure(data=data, layout=layout)
+    else:
+        fig = px.line(
+            df,
+            x=x,
+            y=y,
+            color=color,
+            color_discrete_sequence=color_sequence,
+            category_orders=orders,
+            markers=markers,
+            hover_data=hover_data,
+            custom_data=custom_data,
+        )
+        fig.update_layout(
+            yaxis=dict(title=y_title),
+            xaxis=dict(title=x_title, showgrid=False),
+            hovermode=hovermode,
+            template=dashboard_template(),
+            dragmode=False,
+            legend_title=None,
+        )
+        fig.update_traces(hovertemplate=hovertemplate)
+        fig.update_yaxes(tickformat=format)
+        fig.update_xaxes(
+            tickvals=tickvals,
+            ticktext=ticktext,
+            tickangle=tickangle,
+        )
     fig.update_layout(additional_formatting)
-    fig.write_html(
+    if zoom_detail:
+        # the full traces are loaded when the chart is zoomed in, the template turns zoom off
+        fig.update_layout(dragmode="zoom")
+    round_traces(fig, path_html, dict(x=x, y=y, customdata=custom_data))
+    post_script = downsample(fig, max_points, zoom_detail, path_html)
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
         div_id=div_id,
+        post_script=post_script,
     )
 
 
 # Stacked Percent Bar chart
+@profiled
 def stackedbar(
     df,
     path_html,
@@ -144,43 +1453,55 @@ def stackedbar(
     facet_row=None,
 ):
     config = {"displayModeBar": False}
-    fig = px.bar(
-        df,
-        x=x,
-        y=y,
-        color=color,
-        barmode="stack",
-        facet_col=facet,
-        facet_row=facet_row,
-        color_discrete_sequence=color_sequence,
-        category_orders=orders,
-        orientation=orientation,
-        custom_data=custom_data,
-    )
+    fast = orientation in (None, "v") and facet_row is None
+    if fast and _fast_path(df, x, y, color, facet):
+        data, layout = _fast_figure(
+            df, "bar", x, y, color, color_sequence, orders, facet, custom_data, barmode="stack"
+        )
+        _bar_layout(data, layout, y_title, x_title, hovermode, format, hovertemplate)
+        for axis in _axes(layout, "x"):
+            axis["tickformat"] = ".0f"
+        fig = go.Figure(data=data, layout=layout)
+    else:
+        fig = px.bar(
+            df,
+            x=x,
+            y=y,
+            color=color,
+            barmode="stack",
+            facet_col=facet,
+            facet_row=facet_row,
+            color_discrete_sequence=color_sequence,
+            category_orders=orders,
+            orientation=orientation,
+            custom_data=custom_data,
+        )
 
-    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+        fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
 
-    fig.update_layout(
-        yaxis=dict(tickformat=format, hoverformat=format, title=y_title),
-        xaxis=dict(title=x_title),
-        hovermode=hovermode,
-        template="plotly_white",
-        dragmode=False,
-        legend_title=None,
-    )
-    fig.for_each_yaxis(lambda yaxis: yaxis.update(showticklabels=True, tickformat=format))
-    # fig.for_each_yaxis(lambda yaxis: yaxis.update(tickfont = dict(color = 'rgba(0,0,0,0)')), secondary_y=True)
-    fig.update_yaxes(
-        col=2, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
-    )
-    fig.update_yaxes(
-        col=3, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
-    )
-    fig.update_xaxes(tickformat=".0f")
-    fig.update_traces(hovertemplate=hovertemplate)
+        fig.update_layout(
+            yaxis=dict(tickformat=format, hoverformat=format, title=y_title),
+            xaxis=dict(title=x_title),
+            hovermode=hovermode,
+            template=dashboard_template(),
+            dragmode=False,
+            legend_title=None,
+        )
+        fig.for_each_yaxis(lambda yaxis: yaxis.update(showticklabels=True, tickformat=format))
+        # fig.for_each_yaxis(lambda yaxis: yaxis.update(tickfont = dict(color = 'rgba(0,0,0,0)')), secondary_y=True)
+        fig.update_yaxes(
+            col=2, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
+        )
+        fig.update_yaxes(
+            col=3, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
+        )
+        fig.update_xaxes(tickformat=".0f")
+        fig.update_traces(hovertemplate=hovertemplate)
     fig.update_layout(additional_formatting)
 
-    fig.write_html(
+    round_traces(fig, path_html, dict(x=x, y=y, customdata=custom_data))
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
@@ -189,6 +1510,7 @@ def stackedbar(
 
 
 # Grouped Percent Bar chart
+@profiled
 def groupedbar_percent(
     df,
     path_html,
@@ -208,46 +1530,57 @@ def groupedbar_percent(
     additional_formatting=None,
 ):
     config = {"displayModeBar": False}
-    fig = px.bar(
-        df,
-        x=x,
-        y=y,
-        color=color,
-        barmode="group",
-        facet_col=facet,
-        color_discrete_sequence=color_sequence,
-        category_orders=orders,
-        custom_data=custom_data,
-    )
-    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
-    fig.update_layout(
-        yaxis=dict(tickformat=format, hoverformat=format, title=y_title),
-        xaxis=dict(title=x_title),
-        hovermode=hovermode,
-        template="plotly_white",
-        dragmode=False,
-        legend_title=None,
-        legend=dict(
-            orientation="h",
-            entrywidth=200,
-            # entrywidthmode="fraction",
-            yanchor="bottom",
-            y=1.2,
-            xanchor="right",
-            x=0.8,
-        ),
-    )
-    fig.for_each_yaxis(lambda yaxis: yaxis.update(showticklabels=True, tickformat=format))
-    fig.update_yaxes(
-        col=2, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
+    legend = dict(
+        orientation="h",
+        entrywidth=200,
+        # entrywidthmode="fraction",
+        yanchor="bottom",
+        y=1.2,
+        xanchor="right",
+        x=0.8,
     )
-    fig.update_yaxes(
-        col=3, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
-    )
-    # fig.update_yaxes(col=4,row=1, showticklabels=False,tickfont = dict(color = 'rgba(0,0,0,0)'), title=None)
-    fig.update_traces(hovertemplate=hovertemplate)
+    if _fast_path(df, x, y, color, facet):
+        data, layout = _fast_figure(
+            df, "bar", x, y, color, color_sequence, orders, facet, custom_data, barmode="group"
+        )
+        _bar_layout(data, layout, y_title, x_title, hovermode, format, hovertemplate)
+        layout["legend"].update(legend)
+        fig = go.Figure(data=data, layout=layout)
+    else:
+        fig = px.bar(
+            df,
+            x=x,
+            y=y,
+            color=color,
+            barmode="group",
+            facet_col=facet,
+            color_discrete_sequence=color_sequence,
+            category_orders=orders,
+            custom_data=custom_data,
+        )
+        fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+        fig.update_layout(
+            yaxis=dict(tickformat=format, hoverformat=format, title=y_title),
+            xaxis=dict(title=x_title),
+            hovermode=hovermode,
+            template=dashboard_template(),
+            dragmode=False,
+            legend_title=None,
+            legend=legend,
+        )
+        fig.for_each_yaxis(lambda yaxis: yaxis.update(showticklabels=True, tickformat=format))
+        fig.update_yaxes(
+            col=2, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
+        )
+        fig.update_yaxes(
+            col=3, row=1, showticklabels=False, tickfont=dict(color="rgba(0,0,0,0)"), title=None
+        )
+        # fig.update_yaxes(col=4,row=1, showticklabels=False,tickfont = dict(color = 'rgba(0,0,0,0)'), title=None)
+        fig.update_traces(hovertemplate=hovertemplate)
     fig.update_layout(additional_formatting)
-    fig.write_html(
+    round_traces(fig, path_html, dict(x=x, y=y, customdata=custom_data))
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
@@ -256,6 +1589,7 @@ def groupedbar_percent(
 
 
 # Scatterplot
+@profiled
 def scatterplot(
     df,
     path_html,
@@ -289,7 +1623,7 @@ def scatterplot(
     fig.update_layout(
         yaxis=dict(title=y_title),
         xaxis=dict(title=x_title, showgrid=False),
-        template="plotly_white",
+        template=dashboard_template(),
         hovermode=hovermode,
         dragmode=False,
         legend_title=None,
@@ -300,7 +1634,9 @@ def scatterplot(
     fig.data[legend_number].showlegend = True
     fig.update_traces(hovertemplate=hovertemplate)
     fig.update_layout(additional_formatting)
-    fig.write_html(
+    round_traces(fig, path_html, dict(x=x, y=y, customdata=custom_data))
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
@@ -309,6 +1645,7 @@ def scatterplot(
 
 
 # Stacked Area Chart
+@profiled
 def stacked_area(
     df,
     path_html,
@@ -339,14 +1676,16 @@ def stacked_area(
         yaxis=dict(tickformat=format, hoverformat=format, title=y_title),
         xaxis=dict(title=x_title, tickformat=format, showgrid=False),
         hovermode=hovermode,
-        template="plotly_white",
+        template=dashboard_template(),
         dragmode=False,
         legend_title=None,
     )
     fig.update_traces(hovertemplate=hovertemplate)
     config = {"displayModeBar": False}
     fig.update_layout(additional_formatting)
-    fig.write_html(
+    round_traces(fig, path_html, dict(x=x, y=y, customdata=custom_data))
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
@@ -354,6 +1693,7 @@ def stacked_area(
     )
 
 
+@profiled
 def create_dropdown_bar_chart(
     df,
     path_html,
@@ -427,6 +1767,7 @@ def create_dropdown_bar_chart(
         hovermode=hovermode,
         title=f"{title_text} {orders[dropdown_column][0]}",
         title_x=0.5,
+        template=dashboard_template(),
     )
 
     fig.layout.updatemenus = [
@@ -440,10 +1781,11 @@ def create_dropdown_bar_chart(
         }
     ]
 
-    fig.show()
-    fig.write_html(path_html)
+    round_traces(fig, path_html, dict(x=x, y=y))
+    write_html(fig, path_html)
 
 
+@profiled
 def create_stacked_bar_plot_with_dropdown(
     df,
     path_html,
@@ -541,7 +1883,7 @@ def create_stacked_bar_plot_with_dropdown(
         yaxis=dict(tickformat=format, hoverformat=format, title=y_title),
         xaxis=dict(title=x_title),
         hovermode=hovermode,
-        template="plotly_white",
+        template=dashboard_template(),
         dragmode=False,
         legend_title=title_text,
     )
@@ -554,7 +1896,9 @@ def create_stacked_bar_plot_with_dropdown(
 
     fig.update_layout(additional_formatting)
 
-    fig.write_html(
+    round_traces(fig, path_html, dict(x=x, y=y, customdata=custom_data))
+    write_html(
+        fig,
         config=config,
         file=path_html,
         include_plotlyjs="directory",
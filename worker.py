@@ -0,0 +1,304 @@
+import argparse
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+# A resident build process. Builds run one after another in a long lived child process that
+# keeps the indicator modules, the http connection pools and the recent query results loaded,
+# so a small refresh (PurpleAir, lake level) only costs the build itself instead of a new
+# interpreter. A build that runs past its deadline is killed with its child, and the next build
+# starts a new one forked from a fork server that has the modules imported already.
+# python worker.py serve [--offline] [--cache-only]
+# python worker.py submit 1.2.a 3.1.b [--force] [--timeout 600]
+ADDRESS = ("localhost", int(os.environ.get("DASHBOARD_WORKER_PORT", "6071")))
+# requests must carry this key, DASHBOARD_WORKER_KEY or a random key that serve writes to
+# KEY_PATH readable by its own user only
+KEY_PATH = Path("data/worker.key")
+# nodes run at once by each build
+BUILD_WORKERS = 8
+LOG_PATH = "worker.log"
+# requests and replies are one line of json each, requests longer than this are refused
+MAX_REQUEST_BYTES = 64 * 1024
+# modules the fork server imports once for every build child
+PRELOAD = [
+    "indicators",
+    "plotly.express",
+    "plotly.graph_objects",
+    "arcgis.features",
+    "meteostat",
+    "pytz",
+    "requests",
+]
+OPS = ["build"]
+OPTIONS = ["force", "fetch_only", "render_only"]
+
+
+def _read_key():
+    key = os.environ.get("DASHBOARD_WORKER_KEY")
+    if key:
+        return key
+    if not KEY_PATH.exists():
+        return None
+    return KEY_PATH.read_text().strip()
+
+
+# A new random key in KEY_PATH, created with owner only permissions
+def _write_key():
+    KEY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    key = secrets.token_hex(32)
+    if KEY_PATH.exists():
+        KEY_PATH.unlink()
+    descriptor = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "w") as f:
+        f.write(key)
+    return key
+
+
+# Check a request and return (targets, options, deadline), raises ValueError if it isn't valid
+def _parse_request(request, key):
+    if not isinstance(request, dict):
+        raise ValueError("request must be a json object")
+    if not hmac.compare_digest(str(request.get("key", "")).encode("utf-8"), key.encode("utf-8")):
+        raise PermissionError("wrong key")
+    if request.get("op") not in OPS:
+        raise ValueError(f"unknown op {request.get('op')!r}, expected one of {', '.join(OPS)}")
+    targets = request.get("targets") or ["all"]
+    if not isinstance(targets, list) or not all(isinstance(t, str) for t in targets):
+        raise ValueError("targets must be a list of strings")
+    options = {name: request.get(name, False) for name in OPTIONS}
+    if not all(isinstance(value, bool) for value in options.values()):
+        raise ValueError(f"{', '.join(OPTIONS)} must be true or false")
+    deadline = request.get("deadline")
+    if deadline is not None and not isinstance(deadline, (int, float)):
+        raise ValueError("deadline must be a unix time")
+    return targets, options, deadline
+
+
+# Runs in the build child: apply the serve options, then build every (targets, options) it is
+# sent and answer each with {"results": {node: [status, seconds]}} or {"error": message}.
+# It runs until the worker closes the pipe, so the http sessions, the query memo and the layer
+# info stay loaded from one build to the next.
+def _build_loop(connection, settings):
+    import cassette
+    import indicators
+    import utils
+
+    if settings.get("offline"):
+        cassette.MODE = "replay"
+    if settings.get("cache_only"):
+        utils.CACHE_ONLY = True
+    while True:
+        try:
+            targets, options = connection.recv()
+        except EOFError:
+            return
+        try:
+            results = indicators.build(targets, max_workers=BUILD_WORKERS, **options)
+            reply = dict(
+                results={
+                    name: [indicators.status(result), seconds]
+                    for name, (result, seconds) in results.items()
+                }
+            )
+        except Exception as e:
+            reply = dict(error=f"{type(e).__name__}: {e}")
+        connection.send(reply)
+
+
+# The build child, started on the first build and again after one is killed at its deadline
+class _Builder:
+    def __init__(self, context, settings):
+        self._context = context
+        self._settings = settings
+        self._process = None
+        self._connection = None
+
+    def start(self):
+        if self._process is not None and self._process.is_alive():
+            return
+        self.stop()
+        self._connection, child = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_build_loop, args=(child, self._settings), name="builder"
+        )
+        self._process.start()
+        child.close()
+
+    def stop(self):
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._process.kill()
+        self._process.join()
+        self._connection.close()
+        self._process = self._connection = None
+
+    # Run a build and return {node: [status, seconds]}, the child is killed at the deadline
+    def build(self, targets, options, deadline):
+        self.start()
+        self._connection.send((targets, options))
+        wait = None if deadline is None else max(deadline - time.time(), 0)
+        try:
+            if self._connection.poll(wait):
+                reply = self._connection.recv()
+            else:
+                self.stop()
+                raise TimeoutError(
+                    f"build of {', '.join(targets)} passed its deadline and was killed"
+                )
+        except EOFError:
+            exitcode = self._process.exitcode
+            self.stop()
+            raise RuntimeError(f"build process exited with code {exitcode}") from None
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply["results"]
+
+
+# Answer one request line with {"results": {node: [status, seconds]}} or {"error": message}.
+# Builds run one at a time, they share the manifest and the saved results, a request that
+# can't start before its deadline is refused.
+def _handle(client, key, builder, build_lock):
+    with client, client.makefile("rb") as reader, client.makefile("wb") as writer:
+        try:
+            line = reader.readline(MAX_REQUEST_BYTES + 1)
+            if len(line) > MAX_REQUEST_BYTES:
+                raise ValueError("request too long")
+            targets, options, deadline = _parse_request(json.loads(line), key)
+            import indicators
+
+            targets = indicators.targets_for(targets)
+            wait = -1 if deadline is None else max(deadline - time.time(), 0)
+            if not build_lock.acquire(timeout=wait):
+                raise TimeoutError("another build ran past this request's deadline")
+            try:
+                start = time.perf_counter()
+                results = builder.build(targets, options, deadline)
+            finally:
+                build_lock.release()
+            failed = [name for name, (status, _) in results.items() if status.startswith("failed")]
+            logging.info(
+                f"Built {', '.join(targets)} in {time.perf_counter() - start:.2f}s"
+                + (f", failed: {', '.join(failed)}" if failed else "")
+            )
+            reply = dict(results=results)
+        except Exception as e:
+            logging.warning(f"Request refused or failed: {e!r}")
+            reply = dict(error=f"{type(e).__name__}: {e}")
+        try:
+            writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+            writer.flush()
+        except OSError:
+            # the client gave up waiting (the scheduler's timeout)
+            pass
+
+
+def _build_context():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        # windows, a new build child imports everything again
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(PRELOAD)
+    return context
+
+
+def serve(address=ADDRESS, settings=None):
+    logging.basicConfig(
+        filename=LOG_PATH,
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    start = time.perf_counter()
+    key = os.environ.get("DASHBOARD_WORKER_KEY") or _write_key()
+    # start the build child now so the first build doesn't wait for its imports
+    builder = _Builder(_build_context(), settings or {})
+    builder.start()
+    build_lock = threading.Lock()
+    with socket.create_server(address) as server:
+        logging.info(
+            f"Worker ready on {address[0]}:{address[1]} in {time.perf_counter() - start:.1f}s"
+        )
+        while True:
+            client, _ = server.accept()
+            threading.Thread(
+                target=_handle,
+                args=(client, key, builder, build_lock),
+                daemon=True,
+            ).start()
+
+
+# Build targets (see indicators.plots_for) on the running worker and return
+# {node: (status, seconds)}. The worker kills the build if it isn't done within timeout
+# seconds. Raises ConnectionRefusedError if no worker is listening.
+def submit(
+    targets, force=False, fetch_only=False, render_only=False, timeout=None, address=ADDRESS
+):
+    key = _read_key()
+    if key is None:
+        raise ConnectionRefusedError(f"no worker key in DASHBOARD_WORKER_KEY or {KEY_PATH}")
+    request = dict(
+        key=key,
+        op="build",
+        targets=targets,
+        force=force,
+        fetch_only=fetch_only,
+        render_only=render_only,
+        deadline=None if timeout is None else time.time() + timeout,
+    )
+    with socket.create_connection(address) as client:
+        # a little longer than the deadline so the worker's answer arrives
+        client.settimeout(None if timeout is None else timeout + 10)
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with client.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise RuntimeError("the worker closed the connection without answering")
+    reply = json.loads(line)
+    if "error" in reply:
+        raise RuntimeError(reply["error"])
+    return {name: tuple(result) for name, result in reply["results"].items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resident chart build worker.")
+    parser.add_argument("command", choices=["serve", "submit"])
+    parser.add_argument("targets", nargs="*", default=["all"], help="what to build, for submit")
+    parser.add_argument("--force", action="store_true", help="render unchanged charts too")
+    parser.add_argument("--timeout", type=float, help="submit: seconds before the build is killed")
+    parser.add_argument("--offline", action="store_true", help="serve: replay recorded responses")
+    parser.add_argument(
+        "--cache-only",
+        action="store_true",
+        help="serve: use cached ArcGIS results whatever their age",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(settings=dict(offline=args.offline, cache_only=args.cache_only))
+        return 0
+
+    start = time.perf_counter()
+    try:
+        results = submit(args.targets, force=args.force, timeout=args.timeout)
+    except ConnectionRefusedError:
+        print("No worker is running, start one with python worker.py serve", file=sys.stderr)
+        return 1
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for name, (status, seconds) in sorted(results.items(), key=lambda item: -item[1][1]):
+        print(f"{seconds:8.2f}s  {name}  {status}")
+    print(f"{time.perf_counter() - start:8.2f}s  total")
+    return 1 if any(status.startswith("failed") for status, _ in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())